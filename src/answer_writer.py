@@ -0,0 +1,147 @@
+import random
+import threading
+import time
+import queue
+
+from elasticsearch_integration import ElasticsearchIntegration
+from logging_config import logger
+from config_utils import load_config
+
+ANSWER_INGEST_POLICIES = ("off", "sampled", "feedback")
+
+DEFAULT_ANSWER_INGEST_CONFIG = {
+    "policy": "sampled",        # off | sampled | feedback
+    "sample_rate": 0.1,         # fraction of answers kept when policy is "sampled"
+    "min_length": 300,          # answers shorter than this (in characters) are dropped
+    "min_unique_ratio": 0.3,    # answers with a lower unique/total word ratio are dropped
+    "min_chunk_length": 200,    # chunks shorter than this are never indexed
+    "chunk_size": 500,
+    "batch_size": 20,
+    "flush_interval": 30,       # seconds
+}
+
+class AnswerWriter:
+    """
+    Writes LLM answers back into the RAG index from a background thread.
+
+    Answers are filtered by the configured policy and quality thresholds, queued and
+    indexed in batches, so query workers only pay for a queue put.
+    """
+
+    def __init__(self, config=None):
+        config = config if config is not None else (load_config() or {})
+        self.settings = {**DEFAULT_ANSWER_INGEST_CONFIG, **(config.get("answer_ingest") or {})}
+        if self.settings["policy"] not in ANSWER_INGEST_POLICIES:
+            logger.warning(f"Unknown answer_ingest policy '{self.settings['policy']}', disabling answer ingestion")
+            self.settings["policy"] = "off"
+
+        self.text_splitter = None
+        self.queue = queue.Queue()
+        self.elastic_connection = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def on_answer(self, query_id: str, text: str):
+        """Called when a query completes; queues the answer if the policy samples it."""
+        if self.settings["policy"] != "sampled":
+            return
+        if random.random() >= self.settings["sample_rate"]:
+            return
+        self._submit(query_id, text)
+
+    def on_feedback(self, query_id: str, text: str, positive: bool):
+        """Called when a user rates an answer; queues it on positive feedback if the policy asks for it."""
+        if self.settings["policy"] != "feedback" or not positive:
+            return
+        self._submit(query_id, text)
+
+    def is_worth_indexing(self, text) -> bool:
+        if not text or len(text) < self.settings["min_length"]:
+            return False
+        words = text.lower().split()
+        if not words:
+            return False
+        return len(set(words)) / len(words) >= self.settings["min_unique_ratio"]
+
+    def close(self):
+        """Flushes pending answers and stops the background thread."""
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+        if self.elastic_connection is not None:
+            self.elastic_connection.close_connection()
+            self.elastic_connection = None
+
+    def _submit(self, query_id: str, text: str):
+        if not self.is_worth_indexing(text):
+            logger.debug(f"Skipping low-value answer for query {query_id}")
+            return
+        from langchain.schema import Document
+
+        self._ensure_started()
+        self.queue.put(Document(page_content=text, metadata={"source": f"answer:{query_id}", "query_id": query_id}))
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="answer-writer", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        # An answer waits at most flush_interval seconds, counted from the oldest pending one
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                # Only reached with answers pending, once the oldest one is due
+                self._flush(pending)
+                pending, deadline = [], None
+                continue
+
+            if item is None:
+                if pending:
+                    self._flush(pending)
+                return
+
+            if not pending:
+                deadline = time.monotonic() + self.settings["flush_interval"]
+            pending.append(item)
+            if len(pending) >= self.settings["batch_size"] or time.monotonic() >= deadline:
+                self._flush(pending)
+                pending, deadline = [], None
+
+    def _flush(self, documents):
+        if self.text_splitter is None:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+            self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=self.settings["chunk_size"], chunk_overlap=20)
+
+        splits = [
+            chunk for chunk in self.text_splitter.split_documents(documents)
+            if len(chunk.page_content) >= self.settings["min_chunk_length"]
+        ]
+        if not splits:
+            return
+        try:
+            if self.elastic_connection is None:
+                self.elastic_connection = ElasticsearchIntegration()
+            self.elastic_connection.extract_and_store_documents_and_vectors(splits)
+            logger.info(f"Stored {len(splits)} answer chunks from {len(documents)} answers")
+        except Exception as e:
+            logger.error(f"Error storing answers in RAG database: {e}")
+
+_answer_writer = None
+_answer_writer_lock = threading.Lock()
+
+def get_answer_writer() -> AnswerWriter:
+    """Returns the process-wide AnswerWriter, creating it on first use."""
+    global _answer_writer
+    with _answer_writer_lock:
+        if _answer_writer is None:
+            _answer_writer = AnswerWriter()
+        return _answer_writer
@@ -1,13 +1,24 @@
 import logging
-from typing import List, Dict, Optional
+import threading
+from typing import Any, Dict, Iterator, List, Optional
 from elasticsearch import Elasticsearch
-from langchain_elasticsearch.vectorstores import ElasticsearchStore
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains import RetrievalQA
 from config_utils import load_config
 from logging_config import logger
 
+# LangChain and sentence-transformers (torch) are imported at first use so that processes
+# which never embed or index anything (status polls, string search) start fast.
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings():
+    """Returns the process-wide embedding model, loading it on first use."""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+            _embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+        return _embeddings
+
 class ElasticsearchIntegration:
     """A class to handle Elasticsearch operations."""
 
@@ -17,9 +28,6 @@ class ElasticsearchIntegration:
         if not self.config or not all(key in self.config for key in ["elastic", "rag_database", "ratatoskr"]):
             raise ValueError("Invalid or missing configuration. Exiting.")
 
-        # Update to the new embeddings class
-        self.embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
         # Initialize Elasticsearch with retries
         try:
             self.es = Elasticsearch(
@@ -35,6 +43,10 @@ class ElasticsearchIntegration:
             raise
 
 
+    @property
+    def embeddings(self):
+        return get_embeddings()
+
     def __del__(self):
         """Close the Elasticsearch connection when the object is deleted."""
         self.close_connection()
@@ -53,6 +65,88 @@ class ElasticsearchIntegration:
             logger.error(f"Elasticsearch text search failed: {e}")
             raise
 
+    def open_point_in_time(self, index: str, keep_alive: str = "1m") -> str:
+        """Open a point in time on the index for consistent paginated reads."""
+        try:
+            res = self.es.open_point_in_time(index=index, keep_alive=keep_alive)
+            return res["id"]
+        except Exception as e:
+            logger.error(f"Failed to open point in time on index '{index}': {e}")
+            raise
+
+    def close_point_in_time(self, pit_id: str) -> None:
+        """Close a point in time, releasing the search contexts it holds."""
+        try:
+            self.es.close_point_in_time(id=pit_id)
+        except Exception as e:
+            logger.warning(f"Failed to close point in time: {e}")
+
+    def search_after_page(self, query: Dict, pit_id: str, size: int,
+                          search_after: Optional[List[Any]] = None, keep_alive: str = "1m") -> Dict:
+        """Fetch one page of hits from a point in time, starting after the given sort values."""
+        body = dict(query)
+        body["size"] = size
+        body["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+        body.setdefault("sort", [{"_score": "desc"}, {"_shard_doc": "asc"}])
+        if search_after:
+            body["search_after"] = search_after
+        try:
+            res = self.es.search(body=body)
+            return {"hits": res["hits"]["hits"], "pit_id": res.get("pit_id", pit_id)}
+        except Exception as e:
+            logger.error(f"Elasticsearch search_after page failed: {e}")
+            raise
+
+    def iter_search_after(self, index: str, query: Dict, page_size: int = 500,
+                          max_results: Optional[int] = None, keep_alive: str = "1m") -> Iterator[Dict]:
+        """Yield every hit for the query, one page at a time, past the 10k result window."""
+        pit_id = self.open_point_in_time(index, keep_alive=keep_alive)
+        search_after = None
+        yielded = 0
+        try:
+            while True:
+                size = page_size if max_results is None else min(page_size, max_results - yielded)
+                if size <= 0:
+                    return
+                page = self.search_after_page(query, pit_id, size, search_after, keep_alive=keep_alive)
+                pit_id = page["pit_id"]
+                hits = page["hits"]
+                for hit in hits:
+                    yield hit
+                yielded += len(hits)
+                if len(hits) < size:
+                    return
+                search_after = hits[-1]["sort"]
+        finally:
+            self.close_point_in_time(pit_id)
+
+    def build_vector_query(self, query_text: str, num_candidates: int = 100) -> Dict:
+        """Build a knn query clause over the RAG vectors that can be paginated like a text query."""
+        return {"query": self._knn_clause(self.embeddings.embed_query(query_text), num_candidates)}
+
+    def multi_vector_search(self, query_texts: List[str], k: int = 10, num_candidates: int = 100) -> List[List[Dict]]:
+        """Embed all queries in one batch and retrieve their nearest chunks with a single msearch."""
+        vectors = self.embeddings.embed_documents(query_texts)
+        index = self.config["rag_database"]["index"]
+        searches = []
+        for vector in vectors:
+            searches.append({"index": index})
+            searches.append({
+                "size": k,
+                "_source": ["text", "metadata.source"],
+                "query": self._knn_clause(vector, num_candidates),
+            })
+        try:
+            res = self.es.msearch(searches=searches)
+            return [response.get("hits", {}).get("hits", []) for response in res["responses"]]
+        except Exception as e:
+            logger.error(f"Elasticsearch multi vector search failed: {e}")
+            raise
+
+    @staticmethod
+    def _knn_clause(vector: List[float], num_candidates: int) -> Dict:
+        return {"knn": {"field": "vector", "query_vector": vector, "num_candidates": num_candidates}}
+
     def store_text(self, index: str, document: Dict[str, str]) -> str:
         """Store text in the specified index."""
         try:
@@ -64,6 +158,9 @@ class ElasticsearchIntegration:
 
     def extract_and_store_documents_and_vectors(self, data: List[str]) -> None:
         """Extract and store documents and vectors."""
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from langchain_elasticsearch.vectorstores import ElasticsearchStore
+
         text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=20)
         all_splits = text_splitter.split_documents(data)
 
@@ -82,6 +179,8 @@ class ElasticsearchIntegration:
 
     def query_vector(self, query: str, k: int = 10) -> List[Dict[str, str]]:
         """Query vector from the database."""
+        from langchain_elasticsearch.vectorstores import ElasticsearchStore
+
         try:
             db = ElasticsearchStore(
                 embedding=self.embeddings,
@@ -97,6 +196,9 @@ class ElasticsearchIntegration:
 
     def rag_retrieval_qa(self, question: str) -> Dict[str, str]:
         """Retrieve QA from the database."""
+        from langchain.chains import RetrievalQA
+        from langchain_elasticsearch.vectorstores import ElasticsearchStore
+
         try:
             db = ElasticsearchStore(
                 embedding=self.embeddings,
@@ -127,6 +229,22 @@ class ElasticsearchIntegration:
         index = index or self.config["ratatoskr"]["index"]
         return self.store_text(index, document)
 
+    def store_documents(self, documents: List[Dict], index: Optional[str] = None) -> Dict:
+        """Store several documents in the specified index with one bulk request."""
+        index = index or self.config["ratatoskr"]["index"]
+        operations = []
+        for document in documents:
+            operations.append({"index": {"_index": index}})
+            operations.append(document)
+        try:
+            res = self.es.bulk(operations=operations)
+            if res.get("errors"):
+                logger.warning(f"Bulk store into index '{index}' reported errors")
+            return res
+        except Exception as e:
+            logger.error(f"Failed to bulk store documents in index '{index}': {e}")
+            raise
+
     def update_query(self, update_query: Dict) -> Dict:
         """Update a document in the database."""
         try:
@@ -1,4 +1,3 @@
-from langchain_community.llms import Ollama
 import logging
 
 from logging_config import logger
@@ -19,6 +18,8 @@ class LLMHandler:
             logging.error("Missing or invalid 'ollama.base_url' in config.yaml")
             return None
         
+        from langchain_community.llms import Ollama
+
         self.ollama_session = Ollama(
             model=model,
             verbose=False,
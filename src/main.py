@@ -1,55 +1,99 @@
+import argparse
 import os
+import shutil
 #import threading
 from concurrent.futures import ThreadPoolExecutor
+import json
 import uuid
 import urllib.parse
-from flask import Flask, request, render_template, send_from_directory, jsonify, abort
+from flask import Flask, Response, request, render_template, send_from_directory, jsonify, abort, stream_with_context
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 import logging
 
 # Local modules
-from query_handler import process_query, query_current_status, query_rag_documents, query_metadata_source_documents, process_query_safe
+from query_handler import process_query, query_current_status, query_metadata_source_documents, process_query_safe
+from query_handler import search_documents_page, stream_search_documents, MAX_VECTOR_CANDIDATES
+from query_handler import store_query_batch, process_query_batch_safe, query_batch_status, MAX_BATCH_SIZE
+from query_handler import record_query_feedback, store_query
+from work_queue import get_work_queue, work_queue_settings
+from upload_handler import UploadRejected, UploadRequest, upload_settings, save_stream, sniff_file_type, expand_upload
+from answer_writer import get_answer_writer
 from rag_processor import RagProcessor
 from elasticsearch_integration import ElasticsearchIntegration
 
 from logging_config import logger
 from config_utils import load_config
 
+# Route groups registered by each web role. "serve" runs everything in one process;
+# "read" replicas only answer status polls and searches, "ingest-api" replicas only take in documents.
+# The "query" and "ingest" roles are queue workers, see worker.WORKER_ROLES.
+ROLES = {
+    'serve': ('core', 'status', 'search', 'dialog', 'ingest'),
+    'read': ('core', 'status', 'search'),
+    'ingest-api': ('core', 'ingest'),
+}
+
 class Ratatoskr:
-    def __init__(self, host='127.0.0.1', port=6666, debug=False):
+    def __init__(self, host='127.0.0.1', port=6666, debug=False, role='serve'):
+        if role not in ROLES:
+            raise ValueError(f"Unknown role '{role}', expected one of: {', '.join(ROLES)}")
+
         self.app = Flask(__name__)
-        self.app.config['UPLOAD_FOLDER'] = '/upload'
+        self.app.request_class = UploadRequest
         logging.basicConfig(filename="ratatoskr.log", level=logging.INFO)
         self.config = load_config()
+        self.upload_settings = upload_settings(self.config)
+        self.app.config['UPLOAD_FOLDER'] = ((self.config or {}).get('files') or {}).get('upload', '/upload')
+        self.app.config['MAX_CONTENT_LENGTH'] = self.upload_settings['max_request_bytes']
         self.host = host
         self.port = port
         self.debug = debug
+        self.role = role
+        route_groups = ROLES[role]
+
+        # With a shared work queue configured, dialog and ingest jobs are handed to worker
+        # processes (src/worker.py); otherwise they run on this process' executor.
+        self.work_queue = get_work_queue(self.config) if {'status', 'dialog', 'ingest'} & set(route_groups) else None
+        self.batch_job_size = work_queue_settings(self.config)['batch_job_size']
 
-        # Add the executor for background tasks
-        self.executor = ThreadPoolExecutor(max_workers=5)  # Adjust max_workers as needed
+        # Add the executor for background tasks (only roles that generate answers in-process need it)
+        self.executor = ThreadPoolExecutor(max_workers=5) if 'dialog' in route_groups and self.work_queue is None else None  # Adjust max_workers as needed
 
         # Core
         self.app.route('/', methods=['GET'])(self.index)
         self.app.route('/favicon.ico', methods=['GET'])(self.favicon)
         
         # Query
-        self.app.route('/api/dialog', methods=['POST'])(self.dialog)
-        self.app.route('/api/query_status', methods=['GET'])(self.query_status)
-        self.app.route('/api/vector_search', methods=['POST'])(self.vector_search)
-        self.app.route('/api/string_search', methods=['POST'])(self.string_search)
-        self.app.route('/api/metadata_summary', methods=['POST'])(self.metadata_summary)
+        if 'status' in route_groups:
+            self.app.route('/api/query_status', methods=['GET'])(self.query_status)
+            self.app.route('/api/batch_status', methods=['GET'])(self.batch_status)
+            self.app.route('/api/job_status', methods=['GET'])(self.job_status)
+        if 'search' in route_groups:
+            self.app.route('/api/vector_search', methods=['POST'])(self.vector_search)
+            self.app.route('/api/string_search', methods=['POST'])(self.string_search)
+        if 'dialog' in route_groups:
+            self.app.route('/api/dialog', methods=['POST'])(self.dialog)
+            self.app.route('/api/dialog_batch', methods=['POST'])(self.dialog_batch)
+            self.app.route('/api/feedback', methods=['POST'])(self.feedback)
+            self.app.route('/api/metadata_summary', methods=['POST'])(self.metadata_summary)
         
         # Ingest
         # self.app.route('/api/store_vector', methods=['POST'])(self.store_vector)
         # self.app.route('/store_document', methods=['POST'])(store_document(config=self.config))
-        self.app.route('/api/submit_link', methods=['POST'])(self.submit_link)
-        # self.app.route('/api/upload_file', methods=['POST'])(self.upload_file)
+        if 'ingest' in route_groups:
+            self.app.route('/api/submit_link', methods=['POST'])(self.submit_link)
+            self.app.route('/api/upload_file', methods=['POST'])(self.upload_file)
 
     def run(self):
         try:
             self.app.run(port=self.port, host=self.host, debug=self.debug)
         finally:
-            self.executor.shutdown(wait=True)
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            if self.work_queue is not None:
+                self.work_queue.close()
+            get_answer_writer().close()
 
     def favicon(self):
         self.app = Flask(__name__, static_url_path='/static')
@@ -73,6 +117,15 @@ class Ratatoskr:
 
             logger.info(f"Processing query: {query_id}")
 
+            if self.work_queue is not None:
+                # Store the record here so status polls work while the job waits for a worker
+                store_query(query_id, query, model, user, session)
+                job_id = self.work_queue.enqueue('dialog', {
+                    'query_id': query_id, 'query': query, 'model': model, 'user': user,
+                    'session': session, 'use_rag_database': use_rag_database,
+                })
+                return jsonify(query_id=query_id, job_id=job_id), 200
+
             # Submit to the executor for background processing
             #self.executor.submit(process_query, query_id, query, model, user, session, use_rag_database)
             self.executor.submit(process_query_safe, query_id, query, model, user, session, use_rag_database)
@@ -82,6 +135,71 @@ class Ratatoskr:
             logger.exception(f"Error in dialog endpoint: {e}")
             return jsonify({'error': 'Internal server error'}), 500
 
+    def dialog_batch(self):
+        """
+        Accepts many dialog queries in one request.
+
+        Expects {"queries": [{"query", "model", ...}, ...]}; "user", "session" and
+        "use_rag_database" given at the top level act as defaults for every query.
+        All records are written with one bulk request. The batch is processed as a single
+        background task, or, with a work queue, as dialog_batch jobs of at most
+        work_queue.batch_job_size queries of one model. Poll /api/batch_status with the
+        returned batch_id.
+        """
+        try:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return jsonify({'error': 'Request body must be a JSON object'}), 400
+
+            raw_queries = data.get('queries')
+            if not isinstance(raw_queries, list) or not raw_queries:
+                return jsonify({'error': '"queries" must be a non-empty list'}), 400
+            if len(raw_queries) > MAX_BATCH_SIZE:
+                return jsonify({'error': f'A batch may contain at most {MAX_BATCH_SIZE} queries'}), 400
+
+            batch_id = data.get('batch_id', str(uuid.uuid4()))
+            queries = []
+            query_ids = set()
+            for index, item in enumerate(raw_queries):
+                if not isinstance(item, dict) or not item.get('query') or not item.get('model'):
+                    return jsonify({'error': f'"query" and "model" are required fields (queries[{index}])'}), 400
+                if 'query_id' in item:
+                    if not isinstance(item['query_id'], str) or not item['query_id']:
+                        return jsonify({'error': f'"query_id" must be a non-empty string (queries[{index}])'}), 400
+                    if item['query_id'] in query_ids:
+                        return jsonify({'error': f'Duplicate query_id "{item["query_id"]}" (queries[{index}])'}), 400
+                    query_ids.add(item['query_id'])
+                queries.append({
+                    'query_id': item.get('query_id', str(uuid.uuid4())),
+                    'query': item['query'],
+                    'model': item['model'],
+                    'user': item.get('user', data.get('user', 'anonymous')),
+                    'session': item.get('session', data.get('session', 'default_session')),
+                    'use_rag_database': item.get('use_rag_database', data.get('use_rag_database', False)),
+                })
+
+            logger.info(f"Processing query batch: {batch_id} ({len(queries)} queries)")
+
+            store_query_batch(batch_id, queries)
+            if self.work_queue is not None:
+                # Jobs hold at most batch_job_size queries of one model, so a large batch is
+                # spread over the worker nodes while each job still shares one model's session
+                queries_by_model = {}
+                for q in queries:
+                    queries_by_model.setdefault(q['model'], []).append(q)
+                self.work_queue.enqueue_many('dialog_batch', [
+                    {'batch_id': batch_id, 'queries': model_queries[start:start + self.batch_job_size]}
+                    for model_queries in queries_by_model.values()
+                    for start in range(0, len(model_queries), self.batch_job_size)
+                ])
+            else:
+                self.executor.submit(process_query_batch_safe, batch_id, queries)
+
+            return jsonify(batch_id=batch_id, query_ids=[q['query_id'] for q in queries]), 200
+        except Exception as e:
+            logger.exception(f"Error in dialog_batch endpoint: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+
     def submit_link(self):
         """Processes a URL for RAG (Retrieval Augmented Generation)."""
         try:
@@ -93,6 +211,10 @@ class Ratatoskr:
             parsed_url = urllib.parse.urlparse(url)
             if not all([parsed_url.scheme, parsed_url.netloc]):
                 return jsonify({'error': 'Invalid URL format'}), 400
+
+            if self.work_queue is not None:
+                job_id = self.work_queue.enqueue('ingest_url', {'url': url})
+                return jsonify({'message': 'URL queued for processing', 'job_id': job_id}), 202
             
             try:
                 rag_processor = RagProcessor()
@@ -107,35 +229,73 @@ class Ratatoskr:
             return jsonify({'error': 'An internal server error occurred'}), 500
 
 
-    def upload_file(self):  
-        """Handles file uploads, including validation and saving."""
-        try:
-            if 'file' not in request.files:
-                return jsonify({'error': 'No file part in the request'}), 400
-
-            file = request.files['file']
-
-            if file.filename == '':
-                return jsonify({'error': 'No selected file'}), 400
-
-            if file:
-                # File Type Validation (Added)
-                ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif'}  
-                if not '.' in file.filename or file.filename.rsplit('.', 1)[1].lower() not in ALLOWED_EXTENSIONS:
-                    return jsonify({'error': 'File type not allowed'}), 400
-
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(self.app.config['UPLOAD_FOLDER'], filename)
+    def upload_file(self):
+        """
+        Streams uploaded files to disk and hands them to the ingestion pipeline.
 
-                # Ensure upload directory exists (Added)
-                os.makedirs(self.app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-                file.save(filepath)
-
-                return jsonify({'message': 'File uploaded successfully', 'filename': filename}), 200
+        Accepts multipart uploads ("file"/"files", several allowed) or a raw
+        application/octet-stream body with ?filename=. Either way each file is written once,
+        straight into its upload directory, and rejected with a 413 as soon as it exceeds
+        files.max_file_bytes. Types are detected from the file contents; zip and tar
+        archives are expanded and their members ingested concurrently.
+        """
+        upload_dir = os.path.join(self.app.config['UPLOAD_FOLDER'], str(uuid.uuid4()))
+        keep_upload_dir = False
+        try:
+            os.makedirs(upload_dir, exist_ok=True)
+            max_file_bytes = self.upload_settings['max_file_bytes']
+
+            uploads = []
+            if request.mimetype == 'application/octet-stream':
+                filename = request.args.get('filename')
+                if not filename:
+                    return jsonify({'error': 'Missing "filename" query parameter'}), 400
+                file_path = os.path.join(upload_dir, secure_filename(filename) or 'upload')
+                uploads.append((save_stream(request.stream, file_path, max_file_bytes), filename))
+            else:
+                # Parts are parsed into upload_dir by UploadRequest, see its docstring
+                request.upload_target = (upload_dir, max_file_bytes)
+                for field, file in request.files.items(multi=True):
+                    file.close()
+                    if field in ('file', 'files') and file.filename:
+                        uploads.append((file.stream.name, file.filename))
+                    else:
+                        os.remove(file.stream.name)
+                if not uploads:
+                    return jsonify({'error': 'No file part in the request'}), 400
+
+            entries = []
+            for file_path, filename in uploads:
+                entries.extend(expand_upload(file_path, sniff_file_type(file_path, filename), filename, self.upload_settings))
+            if not entries:
+                return jsonify({'error': 'No supported files found in the upload'}), 415
+
+            if self.work_queue is not None:
+                # Workers read the files from UPLOAD_FOLDER, which has to be shared storage
+                job_ids = self.work_queue.enqueue_many('ingest_file', [
+                    {'path': file_path, 'file_type': file_type, 'source': source, 'upload_dir': upload_dir}
+                    for file_path, file_type, source in entries
+                ])
+                keep_upload_dir = True
+                return jsonify({'message': 'Files queued for processing', 'job_ids': job_ids,
+                                'files': [source for _, _, source in entries]}), 202
+
+            results = RagProcessor().process_files(entries)
+            return jsonify({'files': [
+                {'source': source, 'stored': stored} for (_, _, source), stored in zip(entries, results)
+            ]}), 200
+        except UploadRejected as e:
+            return jsonify({'error': str(e)}), e.status
+        except RequestEntityTooLarge as e:
+            return jsonify({'error': e.description}), 413
+        except HTTPException:
+            raise
         except Exception as e:
             logger.exception(f"Error in upload_file: {e}") 
             return jsonify({'error': 'Internal server error'}), 500
+        finally:
+            if not keep_upload_dir:
+                shutil.rmtree(upload_dir, ignore_errors=True)
 
     def store_document_in_elastic(self):
         """Stores a document in Elasticsearch."""
@@ -190,64 +350,136 @@ class Ratatoskr:
         else:
             return status
         
-    def vector_search(self):
-        if 'query' not in request.json:
-            abort(400, description="Missing query in request")
-
-        query = request.json['query']
-        retrieved_documents = query_rag_documents(query=query)
-        retrieved_documents_list = [doc.__dict__ for doc in retrieved_documents]
+    def feedback(self):
+        """Records a positive or negative rating for a completed query."""
+        data = request.json or {}
+        query_id = data.get('query_id')
+        rating = data.get('rating')
+        if not query_id or rating not in ('positive', 'negative'):
+            return jsonify({'error': '"query_id" and "rating" ("positive" or "negative") are required fields'}), 400
 
-        # Extract the page_content and metadata.source to new JSON dictionary for each document
-        retrieved_documents_list = [{"page_content": doc["page_content"], "metadata_source": doc["metadata"]["source"]} for doc in retrieved_documents_list]
+        try:
+            if record_query_feedback(query_id, rating == 'positive') is None:
+                abort(404, description="Completed query not found")
+            return jsonify({'message': 'Feedback recorded'}), 200
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.exception(f"Error in feedback endpoint: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
 
-        # If metadata.source is a file path, extract the file name
-        for doc in retrieved_documents_list:
-            if doc["metadata_source"].startswith("/mnt/"):
-                doc["metadata_source"] = os.path.basename(doc["metadata_source"])
+    def job_status(self):
+        job_id = request.args.get('job_id')
+        if not job_id:
+            abort(400, description="Missing job_id in request")
+        job = self.work_queue.get(job_id) if self.work_queue is not None else None
+        if job is None:
+            abort(404, description="Job ID not found")
+        return jsonify(job)
+
+    def batch_status(self):
+        batch_id = request.args.get('batch_id')
+        if not batch_id:
+            abort(400, description="Missing batch_id in request")
+        status = query_batch_status(batch_id)
+        if status is None:
+            abort(404, description="Batch ID not found")
+        return jsonify(status)
 
-        return jsonify(retrieved_documents_list), 200
+    def vector_search(self):
+        return self._search("vector", self._format_vector_hit)
 
     def string_search(self):
-            try:
-                query_text = request.json.get('query')
-                if not query_text:
-                    abort(400, description="Missing 'query' in request")
-                max_results = request.json.get('max_results')
-
-                # Convert query_text and max_results to query dict for elasticsearch
-                elastic_query = {
-                    "size": max_results,
-                    "query": {
-                        "query_string": {  # Use query_string for flexible text search
-                            "query": query_text, 
-                            "default_field": "text"  # Search across all fields by default
-                        }
-                    }
-                }
-                elastic_connection = ElasticsearchIntegration()
-                results = elastic_connection.raw_text_search(query=elastic_query)
-
-                # Create a new JSON dictionary with the text and source fields from each result
-                parsed_results = []
-                for result in results:
+        return self._search("string", self._format_string_hit)
+
+    def _search(self, search_type, format_hit):
+        """
+        Shared handler for the search endpoints.
+
+        Without "page_size"/"cursor" the first "max_results" hits are returned as a list.
+        With them, a {"results", "cursor"} page is returned; pass the cursor back to get the
+        next page (point in time + search_after); the cursor carries the page size, so it
+        does not have to be sent again. With "stream": true every hit (up to "max_results")
+        is streamed back as NDJSON; if the search fails midway the last line is an
+        {"error": ...} object.
+
+        Vector searches return at most MAX_VECTOR_CANDIDATES (10000) hits per shard, so
+        larger "max_results"/"page_size" values are rejected; without "max_results" a
+        paginated or streamed vector search stops after DEFAULT_VECTOR_SEARCH_DEPTH (1000) hits.
+        """
+        data = request.json or {}
+        query_text = data.get('query')
+        if not query_text:
+            abort(400, description="Missing 'query' in request")
+        max_results = data.get('max_results')
+        page_size = data.get('page_size')
+        cursor = data.get('cursor')
+        for name, value in (('max_results', max_results), ('page_size', page_size)):
+            if value is not None and not self._is_positive_int(value):
+                return jsonify({'error': f'"{name}" must be a positive integer'}), 400
+            if value is not None and search_type == 'vector' and value > MAX_VECTOR_CANDIDATES:
+                return jsonify({'error': f'"{name}" cannot exceed {MAX_VECTOR_CANDIDATES} for vector search'}), 400
+        if cursor is not None and (not isinstance(cursor, dict) or not isinstance(cursor.get('pit_id'), str)
+                                   or not isinstance(cursor.get('search_after', []), list)
+                                   or not all(self._is_positive_int(cursor[key])
+                                              for key in ('page_size', 'num_candidates') if key in cursor)):
+            return jsonify({'error': '"cursor" must be the cursor object returned by the previous page'}), 400
+
+        try:
+            if data.get('stream'):
+                def generate():
                     try:
-                        source_path = result["_source"]["metadata"]["source"]
-                        filename = os.path.basename(source_path)
-                        parsed_results.append({
-                            "source": filename,
-                            "text": result["_source"]["text"],
-                        })
-                    except KeyError:
-                        logger.warning(f"Missing 'source' or 'text' field in result: {result}")
-                    
-                return parsed_results, 200
-
-            except Exception as e:
-                logger.error(f"Error in query_text: {e}")
-                return jsonify({"error": "Internal server error"}), 500
-            finally:
-                elastic_connection.close_connection()
+                        for hit in stream_search_documents(search_type, query_text, max_results=max_results):
+                            result = format_hit(hit)
+                            if result is not None:
+                                yield json.dumps(result) + "\n"
+                    except Exception as e:
+                        # The status line is already sent, so the failure is reported in-band
+                        logger.exception(f"Error while streaming {search_type}_search results: {e}")
+                        yield json.dumps({"error": "Search failed before all results were sent"}) + "\n"
+
+                return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+            paginate = page_size is not None or cursor is not None
+            page_size = page_size or max_results or 10
+            page = search_documents_page(search_type, query_text, page_size, cursor=cursor, paginate=paginate,
+                                         max_results=max_results)
+            results = [result for result in map(format_hit, page["hits"]) if result is not None]
+
+            if paginate:
+                return jsonify(results=results, cursor=page["cursor"]), 200
+            return jsonify(results), 200
+        except Exception as e:
+            logger.error(f"Error in {search_type}_search: {e}")
+            return jsonify({"error": "Internal server error"}), 500
+
+    @staticmethod
+    def _is_positive_int(value):
+        return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+    @staticmethod
+    def _format_vector_hit(hit):
+        try:
+            source = hit["_source"]
+            metadata_source = source["metadata"]["source"]
+            # If metadata.source is a file path, extract the file name
+            if metadata_source.startswith("/mnt/"):
+                metadata_source = os.path.basename(metadata_source)
+            return {"page_content": source["text"], "metadata_source": metadata_source}
+        except KeyError:
+            logger.warning(f"Missing 'source' or 'text' field in result: {hit}")
+            return None
+
+    @staticmethod
+    def _format_string_hit(hit):
+        try:
+            return {
+                "source": os.path.basename(hit["_source"]["metadata"]["source"]),
+                "text": hit["_source"]["text"],
+            }
+        except KeyError:
+            logger.warning(f"Missing 'source' or 'text' field in result: {hit}")
+            return None
     
     def metadata_summary(self):
         if 'sources' not in request.json:
@@ -285,6 +517,23 @@ class Ratatoskr:
     #         elastic_connection.close_connection()
 
 
-if __name__ == '__main__':       
-    ratatoskr_instance = Ratatoskr(host='0.0.0.0', port=6666, debug=False)
-    ratatoskr_instance.run()
\ No newline at end of file
+if __name__ == '__main__':
+    from worker import WORKER_ROLES, run_worker
+
+    parser = argparse.ArgumentParser(description="Ratatoskr web server and queue worker")
+    parser.add_argument('--role', choices=list(ROLES) + list(WORKER_ROLES), default=os.environ.get('RATATOSKR_ROLE', 'serve'),
+                        help="Web role (which endpoints to serve) or worker role (which queued jobs to run) "
+                             "(default: $RATATOSKR_ROLE or 'serve')")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=6666)
+    parser.add_argument('--concurrency', type=int, default=2, help="Jobs run in parallel by a worker role")
+    args = parser.parse_args()
+
+    if args.role in WORKER_ROLES:
+        try:
+            run_worker(WORKER_ROLES[args.role], concurrency=args.concurrency)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        ratatoskr_instance = Ratatoskr(host=args.host, port=args.port, debug=False, role=args.role)
+        ratatoskr_instance.run()
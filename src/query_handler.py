@@ -1,76 +1,231 @@
 import os
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import abort, jsonify, request
 from elasticsearch_integration import ElasticsearchIntegration
-from rag_processor import RagProcessor
+from answer_writer import get_answer_writer
 from llm_handler import LLMHandler
 
 from logging_config import logger
 
+# Only the fields the search endpoints return are fetched from _source
+SEARCH_SOURCE_FIELDS = ["text", "metadata.source"]
+SEARCH_PAGE_SIZE = 100
+
+# A knn query returns at most num_candidates hits per shard, and Elasticsearch caps
+# num_candidates at 10000, so that is also as deep as a vector search can be paged.
+MAX_VECTOR_CANDIDATES = 10000
+# Depth used for paginated vector searches that do not set max_results
+DEFAULT_VECTOR_SEARCH_DEPTH = 1000
+
+# Upper bound on the number of queries accepted in one batch request
+MAX_BATCH_SIZE = 1000
+# Concurrent generations per model in a batch, unless ollama.batch_concurrency is set
+DEFAULT_BATCH_CONCURRENCY = 4
+
 def process_query_safe(*args, **kwargs):
     try:
         process_query(*args, **kwargs)
     except Exception as e:
         logger.error(f"Error in process_query: {e}", exc_info=True)
 
-def process_query(query_id: str, user_query: str, model: str, user: str, session=None, use_rag_database=False):
-    """
-    This function processes the query, retrieves context from the RAG database and/or the session, generates a response using the LLM, and updates the query status in the database.
-    """
-    # logg process_query
-    logger.info(f"Processing query: {query_id}")
-
-    elastic_connection = ElasticsearchIntegration()
-    llm_handler = LLMHandler()
+def process_query_batch_safe(*args, **kwargs):
+    try:
+        process_query_batch(*args, **kwargs)
+    except Exception as e:
+        logger.error(f"Error in process_query_batch: {e}", exc_info=True)
 
-    # Insert document of query into the database
-    elastic_connection.store_document({
+def build_query_record(query_id: str, user_query: str, model: str, user: str, session=None, batch_id=None):
+    """Returns the document stored in the Ratatoskr index while a query is processed."""
+    return {
         "query_id": query_id,
+        "batch_id": batch_id,
         "user": user,
         "query": user_query,
+        "model": model,
         "status": "processing",
         "session": session,
         "response": "",
         "timestamp": datetime.datetime.now(),
         "type": "chat"
-    })
+    }
 
-    rag_summary = None
-    session_summary = None
+def process_query(query_id: str, user_query: str, model: str, user: str, session=None, use_rag_database=False, store_record=True):
+    """
+    This function processes the query, retrieves context from the RAG database and/or the session, generates a response using the LLM, and updates the query status in the database.
+    Pass store_record=False when the query record was already stored, e.g. by the web replica that queued the query.
+    """
+    # logg process_query
+    logger.info(f"Processing query: {query_id}")
+
+    elastic_connection = ElasticsearchIntegration()
+    llm_handler = LLMHandler()
+
+    # Insert document of query into the database
+    if store_record:
+        elastic_connection.store_document(build_query_record(query_id, user_query, model, user, session))
 
     # Get context from the RAG database if use_rag_database is True
+    rag_documents = None
     if use_rag_database:
         try:
             rag_results = elastic_connection.query_vector(user_query)
-            # Filter out short results
-            rag_results = [x for x in rag_results if len(x.page_content) > 200]
-
-            # Extract content and source information
-            retrieved_documents_list = [
-                {"page_content": doc["page_content"], "metadata_source": doc["metadata"]["source"]} 
+            rag_documents = [
+                {"page_content": doc.page_content, "metadata_source": doc.metadata.get("source", "")}
                 for doc in rag_results
             ]
-
-            # Simplify file paths in metadata_source
-            for doc in retrieved_documents_list:
-                if doc["metadata_source"].startswith("/mnt/"):
-                    doc["metadata_source"] = os.path.basename(doc["metadata_source"])
-
-            # Check if rag_results is empty
-            if not retrieved_documents_list:
-                rag_results = None
-            else:
-                rag_query = (
-                    f"Create a bullet point summary of the following documents found "
-                    f"related to the user query. Page_content is the content found and "
-                    f"metadata_source is the source document: {str(retrieved_documents_list)}"
-                )
-                rag_summary = llm_handler.run_query(query=rag_query, model=model)
         except Exception as e:
-            rag_results = None
             logger.warning(f"Error querying RAG database: {e}")
 
+    try:
+        complete_query(elastic_connection, llm_handler, query_id, user_query, model, session, rag_documents)
+    finally:
+        elastic_connection.close_connection()
+
+def process_query_batch(batch_id: str, queries: list, concurrency=None, skip_completed=False, should_stop=None):
+    """
+    Processes a batch of queries whose records have already been stored with store_query_batch.
+
+    RAG context for every query that asks for it is retrieved up front with a single embedding
+    batch and one msearch. Generation is then grouped per model: every model gets its own
+    pool of `concurrency` threads (ollama.batch_concurrency in config.yaml), each reusing one
+    Ollama session, and all models are served at the same time.
+
+    skip_completed leaves out queries whose record is already completed (used when a queued
+    batch is retried); should_stop is checked before each query and ends the batch early.
+    """
+    logger.info(f"Processing query batch: {batch_id} ({len(queries)} queries)")
+
+    elastic_connection = ElasticsearchIntegration()
+    try:
+        if skip_completed:
+            completed = completed_batch_query_ids(elastic_connection, batch_id)
+            queries = [q for q in queries if q["query_id"] not in completed]
+            logger.info(f"Batch {batch_id}: {len(completed)} queries already completed, {len(queries)} left")
+        if not queries:
+            return
+
+        rag_documents = {}
+        rag_queries = [q for q in queries if q.get("use_rag_database")]
+        if rag_queries:
+            try:
+                results = elastic_connection.multi_vector_search([q["query"] for q in rag_queries])
+                for q, hits in zip(rag_queries, results):
+                    rag_documents[q["query_id"]] = [
+                        {
+                            "page_content": hit["_source"].get("text", ""),
+                            "metadata_source": hit["_source"].get("metadata", {}).get("source", ""),
+                        }
+                        for hit in hits
+                    ]
+            except Exception as e:
+                logger.warning(f"Error querying RAG database for batch {batch_id}: {e}")
+
+        queries_by_model = {}
+        for q in queries:
+            queries_by_model.setdefault(q["model"], []).append(q)
+
+        if concurrency is None:
+            concurrency = (elastic_connection.config.get("ollama") or {}).get("batch_concurrency", DEFAULT_BATCH_CONCURRENCY)
+        llm_handlers = threading.local()
+
+        def run_batch_query(q):
+            if should_stop is not None and should_stop():
+                logger.warning(f"Stopping batch {batch_id} before query {q['query_id']}")
+                return
+            # Pool threads only ever serve one model, so each keeps its Ollama session
+            llm_handler = getattr(llm_handlers, "handler", None)
+            if llm_handler is None:
+                llm_handler = llm_handlers.handler = LLMHandler()
+            try:
+                complete_query(elastic_connection, llm_handler, q["query_id"], q["query"], q["model"],
+                               q.get("session"), rag_documents.get(q["query_id"]))
+            except Exception as e:
+                logger.error(f"Error processing query {q['query_id']} in batch {batch_id}: {e}", exc_info=True)
+
+        executors = [
+            ThreadPoolExecutor(max_workers=min(concurrency, len(model_queries)), thread_name_prefix=f"batch-{model}")
+            for model, model_queries in queries_by_model.items()
+        ]
+        try:
+            futures = [
+                executor.submit(run_batch_query, q)
+                for executor, model_queries in zip(executors, queries_by_model.values())
+                for q in model_queries
+            ]
+            for future in futures:
+                future.result()
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True)
+    finally:
+        elastic_connection.close_connection()
+
+def completed_batch_query_ids(elastic_connection, batch_id: str) -> set:
+    """Returns the query_ids in a batch whose record is already completed."""
+    hits = elastic_connection.iter_search_after(
+        elastic_connection.config["ratatoskr"]["index"],
+        {
+            "query": {
+                "bool": {
+                    "filter": [
+                        {"match_phrase": {"batch_id": batch_id}},
+                        {"match": {"status": "completed"}}
+                    ]
+                }
+            },
+            "_source": ["query_id"]
+        },
+        page_size=SEARCH_PAGE_SIZE,
+        max_results=MAX_BATCH_SIZE
+    )
+    return {hit["_source"]["query_id"] for hit in hits}
+
+def store_query(query_id: str, user_query: str, model: str, user: str, session=None):
+    """Stores the record of a single query before it is queued for a worker."""
+    elastic_connection = ElasticsearchIntegration()
+    try:
+        return elastic_connection.store_document(build_query_record(query_id, user_query, model, user, session))
+    finally:
+        elastic_connection.close_connection()
+
+def store_query_batch(batch_id: str, queries: list):
+    """Stores the records of all queries in a batch with one bulk request."""
+    elastic_connection = ElasticsearchIntegration()
+    try:
+        return elastic_connection.store_documents([
+            build_query_record(q["query_id"], q["query"], q["model"], q["user"], q.get("session"), batch_id)
+            for q in queries
+        ])
+    finally:
+        elastic_connection.close_connection()
+
+def complete_query(elastic_connection, llm_handler, query_id: str, user_query: str, model: str, session=None, rag_documents=None):
+    """
+    Summarizes the retrieved RAG documents and the session history, generates the answer and marks the query completed.
+    """
+    rag_summary = None
+    session_summary = None
+
+    if rag_documents:
+        # Filter out short results
+        retrieved_documents_list = [doc for doc in rag_documents if len(doc["page_content"]) > 200]
+
+        # Simplify file paths in metadata_source
+        for doc in retrieved_documents_list:
+            if doc["metadata_source"].startswith("/mnt/"):
+                doc["metadata_source"] = os.path.basename(doc["metadata_source"])
+
+        if retrieved_documents_list:
+            rag_query = (
+                f"Create a bullet point summary of the following documents found "
+                f"related to the user query. Page_content is the content found and "
+                f"metadata_source is the source document: {str(retrieved_documents_list)}"
+            )
+            rag_summary = llm_handler.run_query(query=rag_query, model=model)
+
     # Get context based on session value
     if session is not None:
         try:
@@ -111,11 +266,63 @@ def process_query(query_id: str, user_query: str, model: str, user: str, session
     }
     elastic_connection.update_query(update_query)
 
-    # Store response in rag_database
-    rag_handler = RagProcessor()
-    rag_handler.process_string_to_vector_db(response)
+    # Hand the response to the background writer, which decides whether it goes into rag_database
+    get_answer_writer().on_answer(query_id, response)
+
+def record_query_feedback(query_id: str, positive: bool):
+    """Stores user feedback on a completed query and returns its record, or None if it is not completed."""
+    record = query_current_status(query_id)
+    if record is None or record.get('status') != 'completed':
+        return None
+    if positive and record.get('feedback') == 'positive':
+        # Already rated positive, and possibly indexed; don't queue the answer a second time
+        return record
+
+    elastic_connection = ElasticsearchIntegration()
+    try:
+        elastic_connection.update_query({
+            "script": {
+                "source": "ctx._source.feedback = params.feedback",
+                "params": {"feedback": "positive" if positive else "negative"}
+            },
+            "query": {"match": {"query_id": query_id}}
+        })
+    finally:
+        elastic_connection.close_connection()
+
+    get_answer_writer().on_feedback(query_id, record.get('response'), positive)
+    return record
+
+def query_batch_status(batch_id: str):
+    """Returns the status of every query in a batch, or None if the batch is unknown."""
+    elastic_connection = ElasticsearchIntegration()
+    try:
+        hits = elastic_connection.iter_search_after(
+            elastic_connection.config["ratatoskr"]["index"],
+            {
+                "query": {"match_phrase": {"batch_id": batch_id}},
+                "_source": ["query_id", "query", "model", "status", "response"]
+            },
+            page_size=SEARCH_PAGE_SIZE,
+            max_results=MAX_BATCH_SIZE
+        )
+        queries = [hit["_source"] for hit in hits]
+        if not queries:
+            return None
 
-    elastic_connection.close_connection()
+        completed = sum(1 for q in queries if q.get("status") == "completed")
+        return {
+            "batch_id": batch_id,
+            "total": len(queries),
+            "completed": completed,
+            "processing": len(queries) - completed,
+            "queries": queries
+        }
+    except Exception as e:
+        logger.exception("Exception occurred while querying batch status:", exc_info=True)
+        return None
+    finally:
+        elastic_connection.close_connection()
 
 def query_current_status(query_id):
     elastic_connection = ElasticsearchIntegration()
@@ -165,17 +372,104 @@ def query_rag_documents(query):
     finally:
         elastic_connection.close_connection()
 
-def query_metadata_source_documents(search_string: str):
-    elastic_connection = ElasticsearchIntegration()
-    try:
-        response = elastic_connection.query_rag_database_document({
+def vector_num_candidates(page_size: int, max_results=None) -> int:
+    """num_candidates for a vector search that has to reach max_results hits, in pages of page_size."""
+    depth = max_results if max_results is not None else DEFAULT_VECTOR_SEARCH_DEPTH
+    return min(max(depth, page_size), MAX_VECTOR_CANDIDATES)
+
+def build_search_query(elastic_connection, search_type: str, query_text: str, num_candidates: int = 100):
+    """Build the Elasticsearch query body for a string or vector search."""
+    if search_type == "vector":
+        elastic_query = elastic_connection.build_vector_query(query_text, num_candidates)
+    else:
+        elastic_query = {
             "query": {
-                "match": {
-                    "metadata.source": search_string
+                "query_string": {
+                    "query": query_text,
+                    "default_field": "text"
                 }
+            }
+        }
+    elastic_query["_source"] = SEARCH_SOURCE_FIELDS
+    return elastic_query
+
+def search_documents_page(search_type: str, query_text: str, page_size: int, cursor=None, paginate=True,
+                          max_results=None):
+    """
+    Returns one page of hits from the RAG database and a cursor for the next page.
+
+    Paginated searches run against a point in time and continue with search_after, so the
+    cursor ({"pit_id", "search_after", "page_size", "num_candidates"}) has to be sent back
+    together with the same query; the page size and vector depth are taken from it.
+    The cursor is None once the result set is exhausted, at which point the PIT is closed.
+    """
+    if cursor:
+        page_size = cursor.get("page_size", page_size)
+        num_candidates = cursor.get("num_candidates") or vector_num_candidates(page_size, max_results)
+    else:
+        num_candidates = vector_num_candidates(page_size, max_results)
+
+    elastic_connection = ElasticsearchIntegration()
+    try:
+        index = elastic_connection.config["rag_database"]["index"]
+        elastic_query = build_search_query(elastic_connection, search_type, query_text, num_candidates)
+
+        if not paginate:
+            elastic_query["size"] = page_size
+            return {"hits": elastic_connection.text_search(index, elastic_query), "cursor": None}
+
+        if cursor:
+            pit_id = cursor["pit_id"]
+            search_after = cursor.get("search_after")
+        else:
+            pit_id = elastic_connection.open_point_in_time(index)
+            search_after = None
+
+        page = elastic_connection.search_after_page(elastic_query, pit_id, page_size, search_after)
+        hits = page["hits"]
+
+        if len(hits) < page_size:
+            elastic_connection.close_point_in_time(page["pit_id"])
+            next_cursor = None
+        else:
+            next_cursor = {"pit_id": page["pit_id"], "search_after": hits[-1]["sort"], "page_size": page_size}
+            if search_type == "vector":
+                next_cursor["num_candidates"] = num_candidates
+
+        return {"hits": hits, "cursor": next_cursor}
+    finally:
+        elastic_connection.close_connection()
+
+def stream_search_documents(search_type: str, query_text: str, max_results=None, page_size=SEARCH_PAGE_SIZE):
+    """
+    Yields every hit for a string or vector search, fetching one page at a time.
+    Errors are raised to the caller, which has to tell the client the stream is incomplete.
+    """
+    elastic_connection = ElasticsearchIntegration()
+    try:
+        index = elastic_connection.config["rag_database"]["index"]
+        elastic_query = build_search_query(elastic_connection, search_type, query_text,
+                                           vector_num_candidates(page_size, max_results))
+        yield from elastic_connection.iter_search_after(index, elastic_query, page_size=page_size, max_results=max_results)
+    finally:
+        elastic_connection.close_connection()
+
+def query_metadata_source_documents(search_string: str, max_documents: int = 1000):
+    elastic_connection = ElasticsearchIntegration()
+    try:
+        response = list(elastic_connection.iter_search_after(
+            elastic_connection.config["rag_database"]["index"],
+            {
+                "query": {
+                    "match": {
+                        "metadata.source": search_string
+                    }
+                },
+                "_source": ["text"]
             },
-            "size": 1000
-        })
+            page_size=SEARCH_PAGE_SIZE,
+            max_results=max_documents
+        ))
 
         logger.debug(f"Number of hits for '{search_string}': {len(response)}")  # Log number of hits
 
@@ -1,23 +1,20 @@
 import os
 from concurrent.futures import ThreadPoolExecutor
-from langchain_community.document_loaders import (
-    CSVLoader, UnstructuredHTMLLoader, JSONLoader, UnstructuredMarkdownLoader,
-    PyPDFLoader, TextLoader, AsyncChromiumLoader
-)
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from elasticsearch_integration import ElasticsearchIntegration
-from langchain_community.document_transformers import BeautifulSoupTransformer
-from langchain.schema import Document
 from logging_config import logger
 from config_utils import load_config
 
 class RagProcessor:
     def __init__(self, config_file='config.yaml', max_threads=4):
         self.max_threads = max_threads
-        self.config = load_config(config_file)
+        self.config = load_config()
+        # Loaders (unstructured, PyPDF, Playwright) are imported where they are used
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=20)
 
     def process_string_to_vector_db(self, text: str):
+        from langchain.schema import Document
+
         try:
             string_document = Document(page_content=text)
             all_splits = self.text_splitter.split_documents([string_document])
@@ -28,34 +25,54 @@ class RagProcessor:
         finally:
             elastic_connection.close_connection()
 
-    def process_file(self, file_path: str):
+    def process_file(self, file_path: str, file_type: str = None, source: str = None) -> bool:
+        """
+        Loads, splits and stores a file, and removes it once it is stored; a file that failed
+        is kept so it can be retried. file_type overrides the extension when picking a loader;
+        source replaces the on-disk path in the chunk metadata.
+        """
+        elastic_connection = None
         try:
-            loader = self._get_loader(file_path)
+            loader = self._get_loader(file_path, file_type)
             documents = loader.load()
             all_splits = self.text_splitter.split_documents(documents)
 
             # Extract metadata (source, optional title, etc.)
-            metadatas = [{ "source": file_path }] * len(all_splits)
+            for split in all_splits:
+                split.metadata["source"] = source or file_path
 
             # Store documents and vectors in Elasticsearch
-            elastic_connection = ElasticsearchIntegration(self.config)
-            elastic_connection.extract_and_store_documents_and_vectors(all_splits, metadatas) 
+            elastic_connection = ElasticsearchIntegration()
+            elastic_connection.extract_and_store_documents_and_vectors(all_splits)
+
+            logger.info(f"Processed and stored file: {source or file_path}")
 
-            logger.info(f"Processed and stored file: {file_path}")
-            
             # Remove file after processing
             os.remove(file_path)
+            return True
         except Exception as e:
             logger.error(f"Error processing file '{file_path}': {e}")
+            return False
+        finally:
+            if elastic_connection is not None:
+                elastic_connection.close_connection()
 
-    def process_files(self, list_of_files: list):
-        """Processes multiple files concurrently."""
+    def process_files(self, list_of_files: list) -> list:
+        """
+        Processes multiple files concurrently. Entries are file paths or
+        (file_path, file_type, source) tuples; returns whether each one was stored.
+        """
         with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-            futures = [executor.submit(self.process_file, file_path) for file_path in list_of_files]
-            for future in futures:
-                future.result()
+            futures = [
+                executor.submit(self.process_file, *entry) if isinstance(entry, tuple) else executor.submit(self.process_file, entry)
+                for entry in list_of_files
+            ]
+            return [future.result() for future in futures]
 
     def process_url(self, url: str):
+        from langchain_community.document_loaders import AsyncChromiumLoader
+        from langchain_community.document_transformers import BeautifulSoupTransformer
+
         try:
             loader = AsyncChromiumLoader([url])
             html = loader.load()
@@ -72,12 +89,18 @@ class RagProcessor:
         finally:
             elastic_connection.close_connection()
 
-    def _get_loader(self, file_path: str):
-        ext = file_path.split('.')[-1].lower()
+    def _get_loader(self, file_path: str, file_type: str = None):
+        from langchain_community.document_loaders import (
+            CSVLoader, UnstructuredHTMLLoader, JSONLoader, UnstructuredMarkdownLoader,
+            PyPDFLoader, TextLoader
+        )
+
+        ext = file_type or file_path.split('.')[-1].lower()
+        if ext == 'json':
+            return JSONLoader(file_path, jq_schema='.', text_content=False)
         loaders = {
             'csv': CSVLoader,
             'html': UnstructuredHTMLLoader,
-            'json': JSONLoader,
             'md': UnstructuredMarkdownLoader,
             'pdf': PyPDFLoader,
             'txt': TextLoader,
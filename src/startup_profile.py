@@ -0,0 +1,54 @@
+"""
+Measures cold-start cost for each process role.
+
+Every role is started in a fresh interpreter that imports main and builds the Ratatoskr
+app (web roles) or Worker (worker roles) for that role, then reports wall-clock
+import/startup time, peak RSS and which heavy dependencies ended up loaded.
+Usage: python src/startup_profile.py [role ...]
+"""
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ["langchain", "langchain_community", "sentence_transformers", "torch", "spacy", "playwright"]
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+import worker
+imported = time.perf_counter()
+if sys.argv[1] in worker.WORKER_ROLES:
+    worker.Worker(None, kinds=list(worker.WORKER_ROLES[sys.argv[1]]))
+else:
+    main.Ratatoskr(role=sys.argv[1])
+ready = time.perf_counter()
+print(json.dumps({
+    "import_s": round(imported - start, 3),
+    "startup_s": round(ready - start, 3),
+    "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    "heavy_modules": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+def profile_role(role: str) -> dict:
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, role],
+        cwd=src_dir, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main(roles):
+    print(f"{'role':<10} {'import (s)':>10} {'startup (s)':>11} {'max RSS (MB)':>13}  heavy modules loaded")
+    for role in roles:
+        stats = profile_role(role)
+        print(f"{role:<10} {stats['import_s']:>10} {stats['startup_s']:>11} {stats['max_rss_mb']:>13}  "
+              f"{', '.join(stats['heavy_modules']) or '-'}")
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from main import ROLES
+    from worker import WORKER_ROLES
+    main(sys.argv[1:] or list(ROLES) + list(WORKER_ROLES))
@@ -0,0 +1,227 @@
+import os
+import shutil
+import tarfile
+import zipfile
+from typing import BinaryIO, List, Optional, Tuple
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+from logging_config import logger
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_UPLOAD_CONFIG = {
+    "max_file_bytes": 200 * 1024 * 1024,       # per uploaded file
+    "max_request_bytes": 1024 * 1024 * 1024,   # whole request body
+    "max_archive_members": 1000,
+    "max_expanded_bytes": 2 * 1024 * 1024 * 1024,
+}
+
+# File types the ingestion pipeline has a loader for
+INGESTIBLE_TYPES = ("pdf", "html", "json", "csv", "md", "txt")
+ARCHIVE_TYPES = ("zip", "tar")
+
+# Extension hints are only used to tell apart text formats that share no magic bytes
+TEXT_EXTENSION_HINTS = {"csv": "csv", "md": "md", "markdown": "md", "htm": "html", "html": "html", "json": "json"}
+
+class UploadRejected(ValueError):
+    """An upload that cannot be accepted; status is the HTTP status code to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+class UploadRequest(Request):
+    """
+    Flask request class that writes multipart file parts straight into an upload directory.
+
+    A view opts in by setting upload_target = (directory, max_file_bytes) before it touches
+    request.files. Each part is then written to "<n>_<filename>" in that directory instead
+    of a temporary file that would have to be copied again, and parsing stops with
+    RequestEntityTooLarge as soon as one part exceeds max_file_bytes (werkzeug drops
+    ValueErrors raised while parsing, so UploadRejected cannot be used here).
+    """
+
+    upload_target = None
+    upload_parts = 0
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_target is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        directory, max_bytes = self.upload_target
+        self.upload_parts += 1
+        file_path = os.path.join(directory, f"{self.upload_parts}_{secure_filename(filename or '') or 'upload'}")
+        return LimitedUploadFile(file_path, max_bytes)
+
+class LimitedUploadFile:
+    """Read/write file for one multipart part that refuses to grow beyond max_bytes."""
+
+    def __init__(self, file_path: str, max_bytes: int):
+        self.name = file_path
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.file = open(file_path, "w+b")
+
+    def write(self, data: bytes) -> int:
+        self.written += len(data)
+        if self.written > self.max_bytes:
+            self.file.close()
+            raise RequestEntityTooLarge(f"Uploaded file exceeds the limit of {self.max_bytes} bytes")
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+def upload_settings(config: Optional[dict]) -> dict:
+    files_config = (config or {}).get("files") or {}
+    return {key: files_config.get(key, default) for key, default in DEFAULT_UPLOAD_CONFIG.items()}
+
+def save_stream(stream: BinaryIO, file_path: str, max_bytes: int) -> str:
+    """Copies a stream to file_path in fixed-size chunks, aborting once it exceeds max_bytes."""
+    written = 0
+    try:
+        with open(file_path, "wb") as target:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadRejected(f"Uploaded file exceeds the limit of {max_bytes} bytes", status=413)
+                target.write(chunk)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    return file_path
+
+def sniff_file_type(file_path: str, filename: Optional[str] = None) -> Optional[str]:
+    """
+    Detects the file type from its leading bytes. Returns one of INGESTIBLE_TYPES or
+    ARCHIVE_TYPES, or None for binary formats the pipeline cannot read.
+    """
+    with open(file_path, "rb") as f:
+        head = f.read(8192)
+
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04") or head.startswith(b"PK\x05\x06"):
+        return "zip"
+    if len(head) > 262 and head[257:262] == b"ustar":
+        return "tar"
+    if head.startswith((b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00")):
+        # Compressed: only accepted if it is a compressed tar archive
+        return "tar" if tarfile.is_tarfile(file_path) else None
+
+    try:
+        text = head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A multi-byte character may be cut off at the end of the sniffed block
+        if e.start < len(head) - 4:
+            return None
+        text = head[:e.start].decode("utf-8")
+    if "\x00" in text:
+        return None
+
+    stripped = text.lstrip().lower()
+    if stripped.startswith(("<!doctype html", "<html")):
+        return "html"
+    if stripped.startswith(("{", "[")):
+        return "json"
+    ext = filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else ""
+    return TEXT_EXTENSION_HINTS.get(ext, "txt")
+
+def expand_upload(file_path: str, file_type: str, source: str, settings: dict) -> List[Tuple[str, str, str]]:
+    """
+    Returns the ingestible files in an upload as (file_path, file_type, source) tuples.
+
+    Archives are extracted next to the upload (members that would escape the directory,
+    links and unreadable types are skipped) and the archive itself is removed.
+    """
+    if file_type in INGESTIBLE_TYPES:
+        return [(file_path, file_type, source)]
+    if file_type not in ARCHIVE_TYPES:
+        os.remove(file_path)
+        raise UploadRejected(f"'{source}' is not a supported file type", status=415)
+
+    extract_dir = f"{file_path}.d"
+    os.makedirs(extract_dir, exist_ok=True)
+    try:
+        if file_type == "zip":
+            members = _extract_zip(file_path, extract_dir, settings)
+        else:
+            members = _extract_tar(file_path, extract_dir, settings)
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        raise UploadRejected(f"'{source}' is not a readable archive: {e}")
+    except UploadRejected:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        raise
+    finally:
+        os.remove(file_path)
+
+    entries = []
+    for member_path, member_name in members:
+        member_type = sniff_file_type(member_path, member_name)
+        if member_type in INGESTIBLE_TYPES:
+            entries.append((member_path, member_type, f"{source}/{member_name}"))
+        else:
+            logger.info(f"Skipping unsupported archive member '{member_name}' in '{source}'")
+            os.remove(member_path)
+    return entries
+
+def _check_member(name: str, size: int, count: int, total: int, settings: dict) -> Optional[str]:
+    if count > settings["max_archive_members"]:
+        raise UploadRejected(f"Archive has more than {settings['max_archive_members']} files", status=413)
+    if size > settings["max_file_bytes"] or total + size > settings["max_expanded_bytes"]:
+        raise UploadRejected("Archive expands beyond the upload limit", status=413)
+    # Clean relative name; drops absolute paths and '..' traversal
+    parts = [secure_filename(part) for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return "/".join(part for part in parts if part) or None
+
+def _extract_zip(file_path: str, extract_dir: str, settings: dict) -> List[Tuple[str, str]]:
+    members, total = [], 0
+    with zipfile.ZipFile(file_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            member_name = _check_member(info.filename, info.file_size, len(members) + 1, total, settings)
+            if member_name is None:
+                continue
+            member_path = os.path.join(extract_dir, f"{len(members)}_{member_name.replace('/', '_')}")
+            with archive.open(info) as source, open(member_path, "wb") as target:
+                # file_size comes from the archive header, so the copy is bounded as well
+                _copy_limited(source, target, info.file_size)
+            total += info.file_size
+            members.append((member_path, member_name))
+    return members
+
+def _extract_tar(file_path: str, extract_dir: str, settings: dict) -> List[Tuple[str, str]]:
+    members, total = [], 0
+    with tarfile.open(file_path) as archive:
+        for info in archive:
+            # Only regular files; links and devices are never extracted
+            if not info.isfile():
+                continue
+            member_name = _check_member(info.name, info.size, len(members) + 1, total, settings)
+            if member_name is None:
+                continue
+            member_path = os.path.join(extract_dir, f"{len(members)}_{member_name.replace('/', '_')}")
+            with archive.extractfile(info) as source, open(member_path, "wb") as target:
+                _copy_limited(source, target, info.size)
+            total += info.size
+            members.append((member_path, member_name))
+    return members
+
+def _copy_limited(source: BinaryIO, target: BinaryIO, max_bytes: int):
+    written = 0
+    while True:
+        chunk = source.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        written += len(chunk)
+        if written > max_bytes:
+            raise UploadRejected("Archive member is larger than its header declares", status=413)
+        target.write(chunk)
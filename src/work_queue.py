@@ -0,0 +1,385 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from logging_config import logger
+
+DEFAULT_WORK_QUEUE_CONFIG = {
+    "backend": "none",              # none (in-process executor) | elasticsearch | sqlite
+    "index": "ratatoskr_jobs",      # elasticsearch backend
+    "path": "ratatoskr_jobs.sqlite",  # sqlite backend
+    "lease_seconds": 120,
+    "max_attempts": 3,
+    "batch_job_size": 20,           # queries per dialog_batch job, so workers can share a batch
+}
+
+class WorkQueue(ABC):
+    """
+    A durable job queue shared by web replicas and worker processes.
+
+    Web replicas enqueue jobs; workers claim them under a lease, renew the lease with
+    heartbeats while they work and complete or fail them. A job whose lease runs out
+    (e.g. its worker died) can be claimed again until it has used up max_attempts.
+
+    Job states: queued -> leased -> completed | failed
+    """
+
+    def __init__(self, lease_seconds: int = 120, max_attempts: int = 3):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    @abstractmethod
+    def enqueue(self, kind: str, payload: Dict, job_id: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def enqueue_many(self, kind: str, payloads: List[Dict]) -> List[str]:
+        """Enqueues one job per payload with a single write; returns the job ids in payload order."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim(self, worker_id: str, kinds: Optional[List[str]] = None) -> Optional[Dict]:
+        """Leases the oldest available job of the given kinds, or returns None if there is none."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Extends the lease; returns False if the worker no longer holds it."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def complete(self, job_id: str, worker_id: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """Releases the job for another attempt, or marks it failed once max_attempts is reached."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def new_job(kind: str, payload: Dict, job_id: Optional[str] = None) -> Dict:
+        now = time.time()
+        return {
+            "job_id": job_id or str(uuid.uuid4()),
+            "kind": kind,
+            "payload": payload,
+            "status": "queued",
+            "attempts": 0,
+            "worker": None,
+            "lease_expires": 0,
+            "error": None,
+            "created": now,
+            "updated": now,
+        }
+
+class SQLiteWorkQueue(WorkQueue):
+    """WorkQueue stored in a SQLite file; shared between processes on one host (or a shared volume)."""
+
+    INSERT_JOB = "INSERT INTO jobs VALUES (:job_id, :kind, :payload, :status, :attempts, :worker, :lease_expires, :error, :created, :updated)"
+
+    def __init__(self, path: str, lease_seconds: int = 120, max_attempts: int = 3):
+        super().__init__(lease_seconds, max_attempts)
+        self.path = path
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    worker TEXT,
+                    lease_expires REAL NOT NULL,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_available ON jobs (status, lease_expires, created)")
+
+    def _connect(self):
+        # A connection per call keeps the queue usable from any thread
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return _ClosingConnection(connection)
+
+    def enqueue(self, kind: str, payload: Dict, job_id: Optional[str] = None) -> str:
+        job = self.new_job(kind, payload, job_id)
+        with self._connect() as connection:
+            connection.execute(self.INSERT_JOB, {**job, "payload": json.dumps(payload)})
+        return job["job_id"]
+
+    def enqueue_many(self, kind: str, payloads: List[Dict]) -> List[str]:
+        jobs = [self.new_job(kind, payload) for payload in payloads]
+        with self._connect() as connection:
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(self.INSERT_JOB, [{**job, "payload": json.dumps(job["payload"])} for job in jobs])
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return [job["job_id"] for job in jobs]
+
+    def claim(self, worker_id: str, kinds: Optional[List[str]] = None) -> Optional[Dict]:
+        now = time.time()
+        kind_filter = ""
+        params = [now, self.max_attempts]
+        if kinds:
+            kind_filter = f" AND kind IN ({', '.join('?' for _ in kinds)})"
+            params.extend(kinds)
+
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose lease expired on their last allowed attempt are given up on
+                connection.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'lease expired', updated = ? "
+                    "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                    (now, now, self.max_attempts)
+                )
+                row = connection.execute(
+                    "SELECT * FROM jobs WHERE (status = 'queued' OR (status = 'leased' AND lease_expires < ?)) "
+                    f"AND attempts < ?{kind_filter} ORDER BY created LIMIT 1",
+                    params
+                ).fetchone()
+                if row is None:
+                    connection.execute("COMMIT")
+                    return None
+                connection.execute(
+                    "UPDATE jobs SET status = 'leased', worker = ?, attempts = attempts + 1, lease_expires = ?, updated = ? "
+                    "WHERE job_id = ?",
+                    (worker_id, now + self.lease_seconds, now, row["job_id"])
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return self.get(row["job_id"])
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        now = time.time()
+        return self._update_leased(job_id, worker_id, "lease_expires = ?, updated = ?", (now + self.lease_seconds, now))
+
+    def complete(self, job_id: str, worker_id: str) -> bool:
+        return self._update_leased(job_id, worker_id, "status = 'completed', updated = ?", (time.time(),))
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        return self._update_leased(
+            job_id, worker_id,
+            "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, worker = NULL, lease_expires = 0, error = ?, updated = ?",
+            (self.max_attempts, error, time.time())
+        )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def _update_leased(self, job_id: str, worker_id: str, assignments: str, params: tuple) -> bool:
+        with self._connect() as connection:
+            cursor = connection.execute(
+                f"UPDATE jobs SET {assignments} WHERE job_id = ? AND worker = ? AND status = 'leased'",
+                params + (job_id, worker_id)
+            )
+            return cursor.rowcount == 1
+
+class ElasticsearchWorkQueue(WorkQueue):
+    """WorkQueue stored in an Elasticsearch index; claims use optimistic concurrency control."""
+
+    # Painless guard shared by the lease-holder-only updates
+    LEASE_GUARD = "if (ctx._source.worker != params.worker || ctx._source.status != 'leased') { ctx.op = 'noop'; return; } "
+
+    def __init__(self, index: str, lease_seconds: int = 120, max_attempts: int = 3, claim_candidates: int = 10):
+        super().__init__(lease_seconds, max_attempts)
+        from elasticsearch_integration import ElasticsearchIntegration
+
+        self.index = index
+        self.claim_candidates = claim_candidates
+        self.elastic_connection = ElasticsearchIntegration()
+        self.es = self.elastic_connection.es
+        if not self.es.indices.exists(index=index):
+            try:
+                self.es.indices.create(index=index, mappings={
+                    "properties": {
+                        "job_id": {"type": "keyword"},
+                        "kind": {"type": "keyword"},
+                        "payload": {"type": "object", "enabled": False},
+                        "status": {"type": "keyword"},
+                        "attempts": {"type": "integer"},
+                        "worker": {"type": "keyword"},
+                        "lease_expires": {"type": "double"},
+                        "error": {"type": "text"},
+                        "created": {"type": "double"},
+                        "updated": {"type": "double"},
+                    }
+                })
+            except Exception as e:
+                # Another replica may have created it in the meantime
+                logger.warning(f"Could not create work queue index '{index}': {e}")
+
+    def enqueue(self, kind: str, payload: Dict, job_id: Optional[str] = None) -> str:
+        job = self.new_job(kind, payload, job_id)
+        # No refresh: workers pick the job up after the next periodic refresh, get() sees it at once
+        self.es.index(index=self.index, id=job["job_id"], document=job)
+        return job["job_id"]
+
+    def enqueue_many(self, kind: str, payloads: List[Dict]) -> List[str]:
+        jobs = [self.new_job(kind, payload) for payload in payloads]
+        operations = []
+        for job in jobs:
+            operations.append({"index": {"_index": self.index, "_id": job["job_id"]}})
+            operations.append(job)
+        res = self.es.bulk(operations=operations)
+        if res.get("errors"):
+            errors = [item["index"]["error"] for item in res["items"] if "error" in item["index"]]
+            raise RuntimeError(f"Failed to enqueue {len(errors)} of {len(jobs)} '{kind}' jobs: {errors[0]}")
+        return [job["job_id"] for job in jobs]
+
+    def claim(self, worker_id: str, kinds: Optional[List[str]] = None) -> Optional[Dict]:
+        from elasticsearch import ConflictError
+
+        now = time.time()
+        filters = [{"range": {"attempts": {"lt": self.max_attempts}}}]
+        if kinds:
+            filters.append({"terms": {"kind": kinds}})
+        res = self.es.search(index=self.index, body={
+            "size": self.claim_candidates,
+            "seq_no_primary_term": True,
+            "sort": [{"created": "asc"}],
+            "query": {
+                "bool": {
+                    "filter": filters,
+                    "should": [
+                        {"term": {"status": "queued"}},
+                        {"bool": {"filter": [
+                            {"term": {"status": "leased"}},
+                            {"range": {"lease_expires": {"lt": now}}}
+                        ]}}
+                    ],
+                    "minimum_should_match": 1
+                }
+            }
+        })
+
+        for hit in res["hits"]["hits"]:
+            job = hit["_source"]
+            job.update({
+                "status": "leased",
+                "worker": worker_id,
+                "attempts": job["attempts"] + 1,
+                "lease_expires": now + self.lease_seconds,
+                "updated": now,
+            })
+            try:
+                # Only succeeds if nobody claimed the job since we read it
+                self.es.index(index=self.index, id=hit["_id"], document=job,
+                              if_seq_no=hit["_seq_no"], if_primary_term=hit["_primary_term"], refresh="wait_for")
+                return job
+            except ConflictError:
+                continue
+        self._fail_exhausted_leases(now)
+        return None
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        now = time.time()
+        return self._update_leased(job_id, worker_id,
+                                   "ctx._source.lease_expires = params.now + params.lease; ctx._source.updated = params.now;",
+                                   {"now": now, "lease": self.lease_seconds})
+
+    def complete(self, job_id: str, worker_id: str) -> bool:
+        return self._update_leased(job_id, worker_id,
+                                   "ctx._source.status = 'completed'; ctx._source.updated = params.now;",
+                                   {"now": time.time()})
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        return self._update_leased(
+            job_id, worker_id,
+            "ctx._source.status = ctx._source.attempts >= params.max_attempts ? 'failed' : 'queued'; "
+            "ctx._source.worker = null; ctx._source.lease_expires = 0; "
+            "ctx._source.error = params.error; ctx._source.updated = params.now;",
+            {"now": time.time(), "error": error, "max_attempts": self.max_attempts}
+        )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        from elasticsearch import NotFoundError
+
+        try:
+            return self.es.get(index=self.index, id=job_id)["_source"]
+        except NotFoundError:
+            return None
+
+    def close(self):
+        self.elastic_connection.close_connection()
+
+    def _update_leased(self, job_id: str, worker_id: str, source: str, params: Dict) -> bool:
+        from elasticsearch import NotFoundError
+
+        try:
+            res = self.es.update(index=self.index, id=job_id, refresh="wait_for", script={
+                "source": self.LEASE_GUARD + source,
+                "params": {**params, "worker": worker_id}
+            })
+            return res["result"] == "updated"
+        except NotFoundError:
+            return False
+
+    def _fail_exhausted_leases(self, now: float):
+        """Marks jobs whose lease expired on their last allowed attempt as failed."""
+        try:
+            self.es.update_by_query(index=self.index, conflicts="proceed", body={
+                "script": {
+                    "source": "ctx._source.status = 'failed'; ctx._source.error = 'lease expired'; ctx._source.updated = params.now;",
+                    "params": {"now": now}
+                },
+                "query": {"bool": {"filter": [
+                    {"term": {"status": "leased"}},
+                    {"range": {"lease_expires": {"lt": now}}},
+                    {"range": {"attempts": {"gte": self.max_attempts}}}
+                ]}}
+            })
+        except Exception as e:
+            logger.warning(f"Failed to expire exhausted jobs: {e}")
+
+class _ClosingConnection:
+    """Context manager that closes the sqlite3 connection on exit (sqlite3's own only ends the transaction)."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, *exc_info):
+        self.connection.close()
+
+def work_queue_settings(config: Optional[Dict]) -> Dict:
+    return {**DEFAULT_WORK_QUEUE_CONFIG, **((config or {}).get("work_queue") or {})}
+
+def get_work_queue(config: Optional[Dict]) -> Optional[WorkQueue]:
+    """Builds the WorkQueue configured under work_queue, or returns None to keep jobs in-process."""
+    settings = work_queue_settings(config)
+    backend = settings["backend"]
+    if backend == "elasticsearch":
+        return ElasticsearchWorkQueue(settings["index"], settings["lease_seconds"], settings["max_attempts"])
+    if backend == "sqlite":
+        path = os.path.expanduser(settings["path"])
+        return SQLiteWorkQueue(path, settings["lease_seconds"], settings["max_attempts"])
+    if backend != "none":
+        raise ValueError(f"Unknown work_queue backend '{backend}', expected one of: none, elasticsearch, sqlite")
+    return None
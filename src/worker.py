@@ -0,0 +1,189 @@
+import argparse
+import os
+import socket
+import threading
+import uuid
+
+from logging_config import logger
+from config_utils import load_config
+from work_queue import get_work_queue
+
+# Handlers get the job payload, whether this is a retry of the job, and an Event that is
+# set once the worker lost the job's lease (another worker may be running it by then).
+
+def run_dialog_job(payload, retry=False, lease_lost=None):
+    from query_handler import process_query, query_current_status
+
+    if retry:
+        record = query_current_status(payload["query_id"])
+        if record is not None and record.get("status") == "completed":
+            logger.info(f"Query {payload['query_id']} was already answered by an earlier attempt")
+            return
+
+    # The web replica already stored the query record when it enqueued the job
+    process_query(payload["query_id"], payload["query"], payload["model"], payload["user"],
+                  payload.get("session"), payload.get("use_rag_database", False), store_record=False)
+
+def run_dialog_batch_job(payload, retry=False, lease_lost=None):
+    from query_handler import process_query_batch
+
+    process_query_batch(payload["batch_id"], payload["queries"], skip_completed=retry,
+                        should_stop=lease_lost.is_set if lease_lost is not None else None)
+
+def run_ingest_url_job(payload, retry=False, lease_lost=None):
+    from rag_processor import RagProcessor
+
+    RagProcessor().process_url(payload["url"])
+
+def run_ingest_file_job(payload, retry=False, lease_lost=None):
+    from rag_processor import RagProcessor
+
+    if not os.path.exists(payload["path"]):
+        raise FileNotFoundError(f"Uploaded file '{payload['path']}' is missing: already ingested, or not on this node's upload volume")
+    stored = RagProcessor().process_file(payload["path"], payload.get("file_type"), payload.get("source"))
+    if not stored:
+        # The file is kept, so the job can be retried once the failure clears
+        raise RuntimeError(f"Failed to ingest '{payload.get('source')}'")
+
+    # Remove the now empty upload (and archive extraction) directories
+    upload_dir = os.path.abspath(payload["upload_dir"])
+    directory = os.path.dirname(os.path.abspath(payload["path"]))
+    while directory.startswith(upload_dir):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+
+JOB_HANDLERS = {
+    "dialog": run_dialog_job,
+    "dialog_batch": run_dialog_batch_job,
+    "ingest_url": run_ingest_url_job,
+    "ingest_file": run_ingest_file_job,
+}
+
+# Job kinds claimed by the worker roles of `main.py --role`
+WORKER_ROLES = {
+    "query": ("dialog", "dialog_batch"),
+    "ingest": ("ingest_url", "ingest_file"),
+}
+
+class Worker:
+    """
+    Claims jobs from the shared work queue and runs them.
+
+    Each of the `concurrency` threads claims one job at a time and renews its lease from a
+    heartbeat thread while the job runs, so a job is only picked up again by another worker
+    if this process stops heartbeating (crash, network partition) or the job fails.
+    """
+
+    def __init__(self, work_queue, kinds=None, concurrency=1, poll_interval=2.0):
+        self.work_queue = work_queue
+        self.kinds = kinds or list(JOB_HANDLERS)
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.stop_event = threading.Event()
+
+    def run(self):
+        logger.info(f"Worker {self.worker_id} started for jobs: {', '.join(self.kinds)}")
+        threads = [
+            threading.Thread(target=self._claim_loop, name=f"worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            logger.info(f"Worker {self.worker_id} stopping")
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _claim_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                job = self.work_queue.claim(self.worker_id, self.kinds)
+            except Exception as e:
+                logger.error(f"Error claiming job: {e}", exc_info=True)
+                job = None
+
+            if job is None:
+                self.stop_event.wait(self.poll_interval)
+                continue
+
+            self.run_job(job)
+
+    def run_job(self, job):
+        job_id = job["job_id"]
+        logger.info(f"Running job {job_id} ({job['kind']}, attempt {job['attempts']})")
+
+        done = threading.Event()
+        lease_lost = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, args=(job_id, done, lease_lost), daemon=True)
+        heartbeat.start()
+        try:
+            JOB_HANDLERS[job["kind"]](job["payload"], retry=job["attempts"] > 1, lease_lost=lease_lost)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+            done.set()
+            heartbeat.join()
+            if not lease_lost.is_set():
+                self.work_queue.fail(job_id, self.worker_id, str(e))
+            return
+
+        done.set()
+        heartbeat.join()
+        if lease_lost.is_set():
+            # The job belongs to whichever worker reclaimed it; leave its state alone
+            logger.warning(f"Job {job_id} stopped after its lease was lost")
+        elif not self.work_queue.complete(job_id, self.worker_id):
+            logger.warning(f"Job {job_id} finished after its lease was lost")
+
+    def _heartbeat_loop(self, job_id, done, lease_lost):
+        interval = max(self.work_queue.lease_seconds / 3, 1)
+        while not done.wait(interval):
+            try:
+                if not self.work_queue.heartbeat(job_id, self.worker_id):
+                    logger.warning(f"Lost lease on job {job_id}")
+                    lease_lost.set()
+                    return
+            except Exception as e:
+                logger.warning(f"Heartbeat for job {job_id} failed: {e}")
+
+def run_worker(kinds, concurrency=2, poll_interval=2.0):
+    """Runs a Worker for the given job kinds against the configured work queue until interrupted."""
+    work_queue = get_work_queue(load_config())
+    if work_queue is None:
+        raise ValueError("work_queue.backend is not configured; set it to 'elasticsearch' or 'sqlite' in config.yaml")
+
+    try:
+        Worker(work_queue, kinds=list(kinds), concurrency=concurrency, poll_interval=poll_interval).run()
+    finally:
+        work_queue.close()
+        from answer_writer import get_answer_writer
+        get_answer_writer().close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ratatoskr queue worker")
+    parser.add_argument('--kinds', default=','.join(JOB_HANDLERS),
+                        help="Comma separated job kinds to claim (default: all)")
+    parser.add_argument('--concurrency', type=int, default=2, help="Jobs run in parallel by this process")
+    parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to wait when the queue is empty")
+    args = parser.parse_args()
+
+    kinds = [kind.strip() for kind in args.kinds.split(',') if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in JOB_HANDLERS]
+    if unknown:
+        parser.error(f"Unknown job kinds: {', '.join(unknown)}")
+
+    try:
+        run_worker(kinds, concurrency=args.concurrency, poll_interval=args.poll_interval)
+    except ValueError as e:
+        parser.error(str(e))
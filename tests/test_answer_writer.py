@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+import answer_writer
+from answer_writer import AnswerWriter
+
+GOOD_ANSWER = " ".join(f"word{i}" for i in range(100))
+
+def make_writer(**settings):
+    return AnswerWriter(config={"answer_ingest": settings})
+
+@pytest.fixture
+def submitted(monkeypatch):
+    calls = []
+    monkeypatch.setattr(AnswerWriter, "_submit", lambda self, query_id, text: calls.append(query_id))
+    return calls
+
+def test_unknown_policy_disables_ingestion(submitted):
+    writer = make_writer(policy="always", sample_rate=1.0)
+
+    writer.on_answer("q1", GOOD_ANSWER)
+    writer.on_feedback("q1", GOOD_ANSWER, positive=True)
+
+    assert writer.settings["policy"] == "off"
+    assert submitted == []
+
+def test_off_policy_ignores_answers_and_feedback(submitted):
+    writer = make_writer(policy="off", sample_rate=1.0)
+
+    writer.on_answer("q1", GOOD_ANSWER)
+    writer.on_feedback("q1", GOOD_ANSWER, positive=True)
+
+    assert submitted == []
+
+def test_sampled_policy_keeps_answers_below_sample_rate(submitted, monkeypatch):
+    writer = make_writer(policy="sampled", sample_rate=0.5)
+    rolls = iter([0.1, 0.5, 0.9])
+    monkeypatch.setattr(answer_writer.random, "random", lambda: next(rolls))
+
+    for query_id in ("q1", "q2", "q3"):
+        writer.on_answer(query_id, GOOD_ANSWER)
+    writer.on_feedback("q4", GOOD_ANSWER, positive=True)
+
+    assert submitted == ["q1"]
+
+def test_feedback_policy_only_keeps_positive_feedback(submitted):
+    writer = make_writer(policy="feedback")
+
+    writer.on_answer("q1", GOOD_ANSWER)
+    writer.on_feedback("q2", GOOD_ANSWER, positive=False)
+    writer.on_feedback("q3", GOOD_ANSWER, positive=True)
+
+    assert submitted == ["q3"]
+
+@pytest.mark.parametrize("text, worth", [
+    (None, False),
+    ("", False),
+    ("short answer", False),
+    (" " * 400, False),
+    ("\n\t " * 200, False),
+    ("same " * 100, False),
+    (GOOD_ANSWER, True),
+], ids=["none", "empty", "short", "spaces", "whitespace", "repetitive", "varied"])
+def test_is_worth_indexing(text, worth):
+    writer = make_writer(min_length=300, min_unique_ratio=0.3)
+
+    assert writer.is_worth_indexing(text) is worth
+
+def test_low_value_answers_are_not_queued():
+    writer = make_writer(policy="feedback")
+
+    writer.on_feedback("q1", " " * 400, positive=True)
+    writer.on_feedback("q2", "same " * 100, positive=True)
+
+    assert writer.queue.empty()
+    assert writer.thread is None
+
+class RecordingFlush:
+    def __init__(self):
+        self.batches = []
+        self.event = threading.Event()
+
+    def __call__(self, documents):
+        self.batches.append((time.monotonic(), list(documents)))
+        self.event.set()
+
+@pytest.fixture
+def flushes(monkeypatch):
+    recorder = RecordingFlush()
+    monkeypatch.setattr(AnswerWriter, "_flush", lambda self, documents: recorder(documents))
+    return recorder
+
+def test_writer_flushes_full_batches_and_pending_answers_on_close(flushes):
+    writer = make_writer(batch_size=2, flush_interval=60)
+    writer._ensure_started()
+    for item in ("a", "b", "c"):
+        writer.queue.put(item)
+    writer.close()
+
+    assert [documents for _, documents in flushes.batches] == [["a", "b"], ["c"]]
+
+def test_flush_interval_is_a_maximum_delay_under_steady_arrivals(flushes):
+    writer = make_writer(batch_size=1000, flush_interval=0.3)
+    writer._ensure_started()
+    started = time.monotonic()
+    try:
+        # Arrivals more frequent than flush_interval must not keep postponing the flush
+        while not flushes.event.is_set() and time.monotonic() - started < 2:
+            writer.queue.put("answer")
+            time.sleep(0.05)
+    finally:
+        writer.close()
+
+    flushed_at, documents = flushes.batches[0]
+    assert flushed_at - started < 0.6
+    assert 0 < len(documents) < 20
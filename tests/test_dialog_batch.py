@@ -0,0 +1,140 @@
+import threading
+import time
+
+import pytest
+
+import main
+import query_handler
+
+class RecordingQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue_many(self, kind, payloads):
+        self.jobs.extend((kind, payload) for payload in payloads)
+        return [f"job-{i}" for i in range(len(self.jobs) - len(payloads), len(self.jobs))]
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def stored_batches(monkeypatch):
+    batches = []
+    monkeypatch.setattr(main, "store_query_batch", lambda batch_id, queries: batches.append((batch_id, queries)))
+    return batches
+
+@pytest.fixture
+def ratatoskr(stored_batches):
+    app = main.Ratatoskr(role="serve")
+    app.work_queue = RecordingQueue()
+    return app
+
+@pytest.fixture
+def client(ratatoskr):
+    return ratatoskr.app.test_client()
+
+@pytest.mark.parametrize("body", [
+    ["not", "an", "object"],
+    "text",
+    {"queries": []},
+    {"queries": "q"},
+    {"queries": [{"query": "q"}]},
+    {"queries": [{"model": "m"}]},
+    {"queries": ["q"]},
+    {"queries": [{"query": "q", "model": "m", "query_id": ["x"]}]},
+    {"queries": [{"query": "q", "model": "m", "query_id": "a"}, {"query": "r", "model": "m", "query_id": "a"}]},
+])
+def test_dialog_batch_rejects_invalid_body(client, stored_batches, body):
+    response = client.post("/api/dialog_batch", json=body)
+
+    assert response.status_code == 400
+    assert stored_batches == []
+
+def test_dialog_batch_rejects_oversized_batch(client):
+    queries = [{"query": "q", "model": "m"}] * (main.MAX_BATCH_SIZE + 1)
+
+    assert client.post("/api/dialog_batch", json={"queries": queries}).status_code == 400
+
+def test_dialog_batch_applies_defaults_and_groups_jobs_by_model(client, ratatoskr, stored_batches):
+    response = client.post("/api/dialog_batch", json={
+        "batch_id": "b1",
+        "user": "alice",
+        "queries": [
+            {"query": "q1", "model": "llama", "query_id": "a"},
+            {"query": "q2", "model": "gemma", "user": "bob"},
+            {"query": "q3", "model": "llama", "use_rag_database": True},
+        ],
+    })
+
+    assert response.status_code == 200
+    body = response.json
+    assert body["batch_id"] == "b1" and body["query_ids"][0] == "a" and len(set(body["query_ids"])) == 3
+
+    (batch_id, queries), = stored_batches
+    assert batch_id == "b1"
+    assert [q["user"] for q in queries] == ["alice", "bob", "alice"]
+    assert [q["use_rag_database"] for q in queries] == [False, False, True]
+
+    jobs = ratatoskr.work_queue.jobs
+    assert [kind for kind, _ in jobs] == ["dialog_batch", "dialog_batch"]
+    assert [[q["query"] for q in payload["queries"]] for _, payload in jobs] == [["q1", "q3"], ["q2"]]
+    assert all(payload["batch_id"] == "b1" for _, payload in jobs)
+
+def test_dialog_batch_splits_model_groups_into_bounded_jobs(client, ratatoskr):
+    ratatoskr.batch_job_size = 2
+    queries = [{"query": f"l{i}", "model": "llama"} for i in range(5)] + [{"query": "g0", "model": "gemma"}]
+
+    assert client.post("/api/dialog_batch", json={"batch_id": "b1", "queries": queries}).status_code == 200
+
+    jobs = [[q["query"] for q in payload["queries"]] for _, payload in ratatoskr.work_queue.jobs]
+    assert jobs == [["l0", "l1"], ["l2", "l3"], ["l4"], ["g0"]]
+
+class FakeConnection:
+    config = {}
+
+    def multi_vector_search(self, query_texts):
+        return [[] for _ in query_texts]
+
+    def close_connection(self):
+        pass
+
+def test_process_query_batch_runs_models_concurrently_with_bounded_pools(monkeypatch):
+    lock = threading.Lock()
+    running = {}
+    peak = {}
+    peak_total = [0]
+    handlers = {}
+
+    def complete_query(elastic_connection, llm_handler, query_id, query, model, session=None, rag_documents=None):
+        with lock:
+            handlers.setdefault(model, set()).add(id(llm_handler))
+            running[model] = running.get(model, 0) + 1
+            peak[model] = max(peak.get(model, 0), running[model])
+            peak_total[0] = max(peak_total[0], sum(running.values()))
+        time.sleep(0.05)
+        with lock:
+            running[model] -= 1
+
+    monkeypatch.setattr(query_handler, "ElasticsearchIntegration", FakeConnection)
+    monkeypatch.setattr(query_handler, "LLMHandler", object)
+    monkeypatch.setattr(query_handler, "complete_query", complete_query)
+
+    queries = [{"query_id": f"{model}-{i}", "query": "q", "model": model} for model in ("a", "b") for i in range(6)]
+    query_handler.process_query_batch("b1", queries, concurrency=2)
+
+    assert peak == {"a": 2, "b": 2}
+    assert peak_total[0] == 4
+    # One handler per pool thread, reused across that thread's queries
+    assert {model: len(ids) for model, ids in handlers.items()} == {"a": 2, "b": 2}
+
+def test_process_query_batch_stops_when_asked(monkeypatch):
+    completed = []
+    monkeypatch.setattr(query_handler, "ElasticsearchIntegration", FakeConnection)
+    monkeypatch.setattr(query_handler, "LLMHandler", object)
+    monkeypatch.setattr(query_handler, "complete_query",
+                        lambda connection, handler, query_id, *args: completed.append(query_id))
+
+    queries = [{"query_id": str(i), "query": "q", "model": "m"} for i in range(5)]
+    query_handler.process_query_batch("b1", queries, concurrency=1, should_stop=lambda: len(completed) >= 2)
+
+    assert completed == ["0", "1"]
@@ -0,0 +1,165 @@
+import pytest
+
+import elasticsearch_integration
+import main
+import query_handler
+from elasticsearch_integration import ElasticsearchIntegration
+
+CONFIG = {"elastic": {}, "rag_database": {"index": "rag"}, "ratatoskr": {"index": "ratatoskr"}}
+
+class FakeElasticsearch:
+    """Serves a fixed list of hits through the point in time / search_after API."""
+
+    def __init__(self, total_hits):
+        self.hits = [
+            {"_id": str(i), "_score": 1.0, "_source": {"text": f"doc {i}", "metadata": {"source": f"s{i}"}},
+             "sort": [1.0, i]}
+            for i in range(total_hits)
+        ]
+        self.searches = []
+        self.open_pits = set()
+        self.closed_pits = []
+
+    def open_point_in_time(self, index, keep_alive):
+        pit_id = f"pit-{len(self.closed_pits) + len(self.open_pits)}"
+        self.open_pits.add(pit_id)
+        return {"id": pit_id}
+
+    def close_point_in_time(self, id):
+        self.open_pits.discard(id)
+        self.closed_pits.append(id)
+
+    def search(self, body=None, index=None):
+        self.searches.append(body)
+        if "pit" in body:
+            assert body["pit"]["id"] in self.open_pits
+        start = body["search_after"][1] + 1 if body.get("search_after") else 0
+        return {"hits": {"hits": self.hits[start:start + body["size"]]}, "pit_id": body.get("pit", {}).get("id")}
+
+    def close(self):
+        pass
+
+STRING_HIT = {"_source": {"text": "a", "metadata": {"source": "/mnt/docs/a.txt"}}}
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        return [0.1, 0.2]
+
+@pytest.fixture
+def fake_es(monkeypatch):
+    es = FakeElasticsearch(total_hits=25)
+
+    def connect():
+        connection = ElasticsearchIntegration.__new__(ElasticsearchIntegration)
+        connection.config = CONFIG
+        connection.es = es
+        return connection
+
+    monkeypatch.setattr(query_handler, "ElasticsearchIntegration", connect)
+    monkeypatch.setattr(elasticsearch_integration, "get_embeddings", lambda: FakeEmbeddings())
+    return es
+
+def test_iter_search_after_reads_every_page_and_closes_pit(fake_es):
+    hits = list(query_handler.stream_search_documents("string", "doc", page_size=10))
+
+    assert [hit["_id"] for hit in hits] == [str(i) for i in range(25)]
+    assert [body["size"] for body in fake_es.searches] == [10, 10, 10]
+    assert fake_es.closed_pits == ["pit-0"] and not fake_es.open_pits
+
+def test_iter_search_after_stops_at_max_results(fake_es):
+    hits = list(query_handler.stream_search_documents("string", "doc", max_results=12, page_size=10))
+
+    assert len(hits) == 12
+    assert [body["size"] for body in fake_es.searches] == [10, 2]
+    assert not fake_es.open_pits
+
+def test_iter_search_after_closes_pit_when_abandoned(fake_es):
+    stream = query_handler.stream_search_documents("string", "doc", page_size=10)
+    next(stream)
+    stream.close()
+
+    assert fake_es.closed_pits == ["pit-0"] and not fake_es.open_pits
+
+def test_search_documents_page_follows_cursor_until_exhausted(fake_es):
+    first = query_handler.search_documents_page("string", "doc", 10)
+    assert first["cursor"] == {"pit_id": "pit-0", "search_after": [1.0, 9], "page_size": 10}
+    assert fake_es.open_pits == {"pit-0"}
+
+    # The page size comes from the cursor
+    second = query_handler.search_documents_page("string", "doc", 3, cursor=first["cursor"])
+    third = query_handler.search_documents_page("string", "doc", 3, cursor=second["cursor"])
+
+    assert [hit["_id"] for hit in second["hits"]] == [str(i) for i in range(10, 20)]
+    assert [hit["_id"] for hit in third["hits"]] == [str(i) for i in range(20, 25)]
+    assert third["cursor"] is None
+    assert fake_es.closed_pits == ["pit-0"] and not fake_es.open_pits
+
+def test_search_documents_page_closes_pit_on_exact_last_page(fake_es):
+    page = query_handler.search_documents_page("string", "doc", 25)
+    assert page["cursor"] is not None
+
+    last = query_handler.search_documents_page("string", "doc", 25, cursor=page["cursor"])
+    assert last["hits"] == [] and last["cursor"] is None
+    assert not fake_es.open_pits
+
+def test_vector_page_derives_num_candidates_and_keeps_it_in_cursor(fake_es):
+    first = query_handler.search_documents_page("vector", "doc", 10, max_results=20)
+    query_handler.search_documents_page("vector", "doc", 10, cursor=first["cursor"], max_results=5000)
+
+    candidates = [body["query"]["knn"]["num_candidates"] for body in fake_es.searches]
+    assert candidates == [20, 20]
+    assert first["cursor"]["num_candidates"] == 20
+
+def test_vector_num_candidates_is_capped():
+    assert query_handler.vector_num_candidates(10) == query_handler.DEFAULT_VECTOR_SEARCH_DEPTH
+    assert query_handler.vector_num_candidates(500, max_results=50) == 500
+    assert query_handler.vector_num_candidates(10, max_results=10 ** 6) == query_handler.MAX_VECTOR_CANDIDATES
+
+@pytest.fixture
+def client():
+    return main.Ratatoskr(role="read").app.test_client()
+
+@pytest.mark.parametrize("body", [
+    {"max_results": 0},
+    {"max_results": "10"},
+    {"page_size": True},
+    {"cursor": "abc"},
+    {"cursor": {"search_after": [1]}},
+    {"cursor": {"pit_id": "p", "search_after": 1}},
+    {"cursor": {"pit_id": "p", "search_after": [1], "page_size": -1}},
+])
+def test_search_rejects_invalid_parameters(client, body):
+    response = client.post("/api/string_search", json={"query": "doc", **body})
+
+    assert response.status_code == 400
+
+def test_vector_search_rejects_depth_above_candidate_cap(client):
+    response = client.post("/api/vector_search", json={"query": "doc", "max_results": 10001})
+
+    assert response.status_code == 400
+
+def test_search_returns_page_and_cursor(client, monkeypatch):
+    calls = []
+
+    def search_documents_page(search_type, query_text, page_size, cursor=None, paginate=True, max_results=None):
+        calls.append((page_size, paginate))
+        return {"hits": [STRING_HIT], "cursor": {"pit_id": "p", "search_after": [1]}}
+
+    monkeypatch.setattr(main, "search_documents_page", search_documents_page)
+    response = client.post("/api/string_search", json={"query": "doc", "page_size": 5})
+
+    assert response.status_code == 200
+    assert response.json == {"results": [{"source": "a.txt", "text": "a"}], "cursor": {"pit_id": "p", "search_after": [1]}}
+    assert calls == [(5, True)]
+
+def test_stream_reports_failure_as_last_line(client, monkeypatch):
+    def stream_search_documents(search_type, query_text, max_results=None):
+        yield STRING_HIT
+        raise ConnectionError("node left")
+
+    monkeypatch.setattr(main, "stream_search_documents", stream_search_documents)
+    response = client.post("/api/string_search", json={"query": "doc", "stream": True})
+
+    lines = response.get_data(as_text=True).splitlines()
+    assert response.status_code == 200
+    assert lines == ['{"source": "a.txt", "text": "a"}', '{"error": "Search failed before all results were sent"}']
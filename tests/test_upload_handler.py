@@ -0,0 +1,229 @@
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from upload_handler import (
+    DEFAULT_UPLOAD_CONFIG, UploadRejected, expand_upload, save_stream, sniff_file_type, upload_settings
+)
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR"
+
+@pytest.fixture
+def settings():
+    return dict(DEFAULT_UPLOAD_CONFIG)
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+def make_zip(path, members):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return str(path)
+
+def add_tar_file(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+def extracted_files(tmp_path):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), tmp_path)
+        for root, _, names in os.walk(tmp_path) for name in names
+    )
+
+@pytest.mark.parametrize("data, filename, expected", [
+    (b"%PDF-1.7\n...", "report.txt", "pdf"),
+    (b"<!DOCTYPE html><html></html>", "page.txt", "html"),
+    (b"  <html><body>hi</body></html>", None, "html"),
+    (b'{"key": "value"}', "data.txt", "json"),
+    (b"a,b\n1,2\n", "table.csv", "csv"),
+    (b"# Title\n", "notes.md", "md"),
+    (b"plain text", "notes.pdf", "txt"),
+    (b"", None, "txt"),
+    (PNG_HEADER, "image.txt", None),
+    (b"text\x00with nul", "file.txt", None),
+])
+def test_sniff_file_type_uses_content_not_extension(tmp_path, data, filename, expected):
+    assert sniff_file_type(write(tmp_path / "upload", data), filename) == expected
+
+def test_sniff_file_type_tolerates_multibyte_character_cut_at_block_end(tmp_path):
+    data = b"a" * 8191 + "é".encode("utf-8")
+    assert sniff_file_type(write(tmp_path / "upload", data), "notes.txt") == "txt"
+
+def test_sniff_file_type_detects_archives(tmp_path):
+    zip_path = make_zip(tmp_path / "a.bin", {"a.txt": "a"})
+    tar_path = str(tmp_path / "a.tar")
+    tgz_path = str(tmp_path / "a.tgz")
+    for path, mode in ((tar_path, "w"), (tgz_path, "w:gz")):
+        with tarfile.open(path, mode) as archive:
+            add_tar_file(archive, "a.txt", b"a")
+    plain_gzip = write(tmp_path / "a.gz", gzip.compress(b"not a tar archive"))
+
+    assert sniff_file_type(zip_path) == "zip"
+    assert sniff_file_type(tar_path) == "tar"
+    assert sniff_file_type(tgz_path) == "tar"
+    assert sniff_file_type(plain_gzip) is None
+
+def test_save_stream_copies_in_chunks(tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    path = save_stream(io.BytesIO(data), str(tmp_path / "upload"), max_bytes=len(data))
+    assert open(path, "rb").read() == data
+
+def test_save_stream_rejects_oversized_upload_and_removes_partial_file(tmp_path):
+    target = tmp_path / "upload"
+    with pytest.raises(UploadRejected) as excinfo:
+        save_stream(io.BytesIO(b"x" * 11), str(target), max_bytes=10)
+    assert excinfo.value.status == 413
+    assert not target.exists()
+
+def test_upload_settings_override_defaults():
+    settings = upload_settings({"files": {"upload": "/upload", "max_file_bytes": 5}})
+    assert settings["max_file_bytes"] == 5
+    assert settings["max_archive_members"] == DEFAULT_UPLOAD_CONFIG["max_archive_members"]
+
+def test_expand_upload_passes_through_ingestible_file(tmp_path, settings):
+    path = write(tmp_path / "notes", b"hello")
+    assert expand_upload(path, "txt", "notes.txt", settings) == [(path, "txt", "notes.txt")]
+
+def test_expand_upload_rejects_unsupported_type_and_removes_it(tmp_path, settings):
+    path = write(tmp_path / "image", PNG_HEADER)
+    with pytest.raises(UploadRejected) as excinfo:
+        expand_upload(path, sniff_file_type(path), "image.png", settings)
+    assert excinfo.value.status == 415
+    assert not os.path.exists(path)
+
+def test_zip_members_cannot_escape_extract_dir(tmp_path, settings):
+    upload_dir = tmp_path / "upload"
+    upload_dir.mkdir()
+    path = make_zip(upload_dir / "bundle", {
+        "../../evil.txt": "escape attempt",
+        "/etc/passwd.txt": "absolute path",
+        "docs/./readme.md": "# nested",
+        "..": "only dots",
+    })
+
+    entries = expand_upload(path, "zip", "bundle.zip", settings)
+
+    assert sorted(source for _, _, source in entries) == [
+        "bundle.zip/docs/readme.md", "bundle.zip/etc/passwd.txt", "bundle.zip/evil.txt"
+    ]
+    for member_path, _, _ in entries:
+        assert os.path.dirname(member_path) == os.path.join(str(upload_dir), "bundle.d")
+    # Nothing written outside the upload directory, and the archive itself is gone
+    assert all(name.startswith("upload") for name in extracted_files(tmp_path))
+    assert not os.path.exists(path)
+
+def test_tar_links_are_not_extracted(tmp_path, settings):
+    path = str(tmp_path / "bundle")
+    with tarfile.open(path, "w") as archive:
+        add_tar_file(archive, "real.txt", b"real content")
+        symlink = tarfile.TarInfo("link.txt")
+        symlink.type = tarfile.SYMTYPE
+        symlink.linkname = "/etc/passwd"
+        archive.addfile(symlink)
+        hardlink = tarfile.TarInfo("hard.txt")
+        hardlink.type = tarfile.LNKTYPE
+        hardlink.linkname = "real.txt"
+        archive.addfile(hardlink)
+
+    entries = expand_upload(path, "tar", "bundle.tar", settings)
+
+    assert [source for _, _, source in entries] == ["bundle.tar/real.txt"]
+    assert open(entries[0][0], "rb").read() == b"real content"
+    assert not any(os.path.islink(os.path.join(root, name))
+                   for root, _, names in os.walk(tmp_path) for name in names)
+
+def test_unsupported_archive_members_are_skipped(tmp_path, settings):
+    path = make_zip(tmp_path / "bundle", {"notes.md": "# notes", "image.png": PNG_HEADER})
+
+    entries = expand_upload(path, "zip", "bundle.zip", settings)
+
+    assert [(file_type, source) for _, file_type, source in entries] == [("md", "bundle.zip/notes.md")]
+    assert extracted_files(tmp_path) == [os.path.relpath(entries[0][0], tmp_path)]
+
+@pytest.mark.parametrize("archive_type", ["zip", "tar"])
+@pytest.mark.parametrize("limit, value", [
+    ("max_archive_members", 1),
+    ("max_file_bytes", 4),
+    ("max_expanded_bytes", 8),
+])
+def test_archive_limits_reject_upload_and_clean_up(tmp_path, settings, archive_type, limit, value):
+    members = {"a.txt": b"12345", "b.txt": b"67890"}
+    path = str(tmp_path / "bundle")
+    if archive_type == "zip":
+        make_zip(path, members)
+    else:
+        with tarfile.open(path, "w") as archive:
+            for name, data in members.items():
+                add_tar_file(archive, name, data)
+    settings[limit] = value
+
+    with pytest.raises(UploadRejected) as excinfo:
+        expand_upload(path, archive_type, "bundle", settings)
+
+    assert excinfo.value.status == 413
+    assert extracted_files(tmp_path) == []
+
+def test_corrupt_archive_is_rejected(tmp_path, settings):
+    path = write(tmp_path / "bundle", b"PK\x03\x04 truncated")
+    with pytest.raises(UploadRejected) as excinfo:
+        expand_upload(path, "zip", "bundle.zip", settings)
+    assert excinfo.value.status == 400
+    assert extracted_files(tmp_path) == []
+
+class RecordingQueue:
+    def __init__(self):
+        self.payloads = []
+
+    def enqueue_many(self, kind, payloads):
+        self.payloads.extend(payloads)
+        return [f"job-{i}" for i in range(len(payloads))]
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def upload_app(tmp_path, monkeypatch):
+    import main
+    import werkzeug.wrappers.request
+
+    def no_temp_files(**kwargs):
+        raise AssertionError("multipart part was spooled to a temporary file")
+
+    monkeypatch.setattr(werkzeug.wrappers.request, "default_stream_factory", no_temp_files)
+    app = main.Ratatoskr(role="ingest-api")
+    app.app.config["UPLOAD_FOLDER"] = str(tmp_path)
+    app.upload_settings = {**DEFAULT_UPLOAD_CONFIG, "max_file_bytes": 1000}
+    app.work_queue = RecordingQueue()
+    return app
+
+def test_multipart_parts_are_written_once_into_upload_dir(tmp_path, upload_app):
+    response = upload_app.app.test_client().post("/api/upload_file", data={
+        "files": [(io.BytesIO(b"first file"), "a.txt"), (io.BytesIO(b"# second"), "b.md")],
+        "other": (io.BytesIO(b"ignored"), "c.txt"),
+    }, content_type="multipart/form-data")
+
+    assert response.status_code == 202
+    assert response.json["files"] == ["a.txt", "b.md"]
+    paths = [payload["path"] for payload in upload_app.work_queue.payloads]
+    assert [open(path, "rb").read() for path in paths] == [b"first file", b"# second"]
+    assert [payload["file_type"] for payload in upload_app.work_queue.payloads] == ["txt", "md"]
+    # Only the two accepted parts are left, directly in the upload directory
+    assert {os.path.dirname(path) for path in paths} == {upload_app.work_queue.payloads[0]["upload_dir"]}
+    assert len(extracted_files(tmp_path)) == 2
+
+def test_multipart_part_over_limit_is_rejected_while_streaming(tmp_path, upload_app):
+    response = upload_app.app.test_client().post("/api/upload_file", data={
+        "file": (io.BytesIO(b"x" * 5000), "big.txt"),
+    }, content_type="multipart/form-data")
+
+    assert response.status_code == 413
+    assert "1000 bytes" in response.json["error"]
+    assert upload_app.work_queue.payloads == []
+    assert extracted_files(tmp_path) == []
@@ -0,0 +1,163 @@
+import sqlite3
+import time
+
+import pytest
+
+from work_queue import ElasticsearchWorkQueue, SQLiteWorkQueue, WorkQueue, get_work_queue
+
+LEASE_SECONDS = 0.5
+
+@pytest.fixture
+def work_queue(tmp_path):
+    return SQLiteWorkQueue(str(tmp_path / "jobs.sqlite"), lease_seconds=LEASE_SECONDS, max_attempts=2)
+
+def expire_lease():
+    time.sleep(LEASE_SECONDS + 0.1)
+
+def test_incomplete_backend_cannot_be_constructed():
+    class PartialQueue(WorkQueue):
+        def enqueue(self, kind, payload, job_id=None):
+            return "job"
+
+    with pytest.raises(TypeError):
+        PartialQueue()
+
+def test_claim_leases_oldest_job_of_requested_kind(work_queue):
+    dialog_id = work_queue.enqueue("dialog", {"query": "q"})
+    work_queue.enqueue("ingest_url", {"url": "u"})
+
+    job = work_queue.claim("w1", ["dialog"])
+
+    assert job["job_id"] == dialog_id
+    assert job["payload"] == {"query": "q"}
+    assert job["status"] == "leased"
+    assert job["worker"] == "w1"
+    assert job["attempts"] == 1
+    assert work_queue.claim("w2", ["dialog"]) is None
+
+def test_heartbeat_only_succeeds_for_lease_holder(work_queue):
+    job_id = work_queue.enqueue("dialog", {})
+    work_queue.claim("w1")
+
+    assert work_queue.heartbeat(job_id, "w1")
+    assert not work_queue.heartbeat(job_id, "w2")
+
+def test_heartbeat_keeps_lease_alive(work_queue):
+    job_id = work_queue.enqueue("dialog", {})
+    work_queue.claim("w1")
+
+    time.sleep(LEASE_SECONDS / 2)
+    work_queue.heartbeat(job_id, "w1")
+    time.sleep(LEASE_SECONDS / 2 + 0.05)
+
+    assert work_queue.claim("w2") is None
+
+def test_expired_lease_is_reclaimed_and_stale_worker_is_rejected(work_queue):
+    job_id = work_queue.enqueue("dialog", {})
+    work_queue.claim("w1")
+    expire_lease()
+
+    job = work_queue.claim("w2")
+
+    assert job["job_id"] == job_id
+    assert job["worker"] == "w2"
+    assert job["attempts"] == 2
+    assert not work_queue.heartbeat(job_id, "w1")
+    assert not work_queue.complete(job_id, "w1")
+    assert work_queue.complete(job_id, "w2")
+    assert work_queue.get(job_id)["status"] == "completed"
+
+def test_fail_requeues_until_max_attempts_then_marks_failed(work_queue):
+    job_id = work_queue.enqueue("dialog", {})
+
+    work_queue.claim("w1")
+    assert work_queue.fail(job_id, "w1", "first error")
+    job = work_queue.get(job_id)
+    assert job["status"] == "queued"
+    assert job["worker"] is None
+    assert job["error"] == "first error"
+
+    work_queue.claim("w1")
+    assert work_queue.fail(job_id, "w1", "second error")
+    job = work_queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "second error"
+    assert work_queue.claim("w1") is None
+
+def test_exhausted_lease_is_marked_failed(work_queue):
+    job_id = work_queue.enqueue("dialog", {})
+    work_queue.claim("w1")
+    expire_lease()
+    work_queue.claim("w2")
+    expire_lease()
+
+    assert work_queue.claim("w3") is None
+    job = work_queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "lease expired"
+
+def test_enqueue_many_queues_every_payload_in_order(work_queue):
+    job_ids = work_queue.enqueue_many("ingest_file", [{"path": "a"}, {"path": "b"}, {"path": "c"}])
+
+    assert len(set(job_ids)) == 3
+    assert [work_queue.get(job_id)["payload"]["path"] for job_id in job_ids] == ["a", "b", "c"]
+    claimed = [work_queue.claim("w1")["job_id"] for _ in job_ids]
+    assert sorted(claimed) == sorted(job_ids)
+
+def test_enqueue_many_is_all_or_nothing(work_queue, monkeypatch):
+    # The second insert hits the primary key of the first
+    monkeypatch.setattr(work_queue, "new_job", lambda kind, payload, job_id=None: WorkQueue.new_job(kind, payload, "same"))
+
+    with pytest.raises(sqlite3.IntegrityError):
+        work_queue.enqueue_many("ingest_file", [{"path": "a"}, {"path": "b"}])
+
+    assert work_queue.claim("w1") is None
+
+class FakeBulkElasticsearch:
+    def __init__(self, failing_positions=()):
+        self.bulk_calls = []
+        self.failing_positions = failing_positions
+
+    def bulk(self, operations, **kwargs):
+        self.bulk_calls.append((operations, kwargs))
+        items = []
+        for position, action in enumerate(operations[::2]):
+            item = {"_id": action["index"]["_id"], "result": "created"}
+            if position in self.failing_positions:
+                item = {"_id": action["index"]["_id"], "error": {"type": "mapper_parsing_exception"}}
+            items.append({"index": item})
+        return {"errors": bool(self.failing_positions), "items": items}
+
+def make_elasticsearch_queue(es):
+    work_queue = ElasticsearchWorkQueue.__new__(ElasticsearchWorkQueue)
+    WorkQueue.__init__(work_queue)
+    work_queue.index = "jobs"
+    work_queue.es = es
+    return work_queue
+
+def test_elasticsearch_enqueue_many_sends_one_bulk_without_refresh():
+    es = FakeBulkElasticsearch()
+    job_ids = make_elasticsearch_queue(es).enqueue_many("dialog_batch", [{"n": 1}, {"n": 2}])
+
+    (operations, kwargs), = es.bulk_calls
+    assert "refresh" not in kwargs
+    assert [action["index"]["_id"] for action in operations[::2]] == job_ids
+    assert [job["payload"] for job in operations[1::2]] == [{"n": 1}, {"n": 2}]
+    assert all(job["status"] == "queued" and job["kind"] == "dialog_batch" for job in operations[1::2])
+
+def test_elasticsearch_enqueue_many_raises_on_item_errors():
+    work_queue = make_elasticsearch_queue(FakeBulkElasticsearch(failing_positions={1}))
+
+    with pytest.raises(RuntimeError):
+        work_queue.enqueue_many("ingest_file", [{"path": "a"}, {"path": "b"}])
+
+def test_get_unknown_job_returns_none(work_queue):
+    assert work_queue.get("missing") is None
+
+def test_get_work_queue_backends(tmp_path):
+    assert get_work_queue(None) is None
+    assert get_work_queue({"work_queue": {"backend": "none"}}) is None
+    assert isinstance(get_work_queue({"work_queue": {"backend": "sqlite", "path": str(tmp_path / "q.sqlite")}}),
+                      SQLiteWorkQueue)
+    with pytest.raises(ValueError):
+        get_work_queue({"work_queue": {"backend": "redis"}})